@@ -2,95 +2,154 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog
 
-import numpy as np
-import pydicom
 import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
-from scipy.ndimage import gaussian_filter, median_filter, uniform_filter
+
+from ct_filters import FILTER_MODES, FILTER_TYPES, FilterJob
+from dicom_index import find_series_files
+from dicom_volume import CTVolume, open_ct_volume
+from planes import PLANES, plane_aspect, plane_length, plane_slice
+from result_cache import ResultCache
+from slice_renderer import SliceRenderer
 
 # Global variables
 ct_data = None
 filtered_data = None
 filter_type = "original"
 filter_params = {"gaussian_radius": 3, "gaussian_std": 1, "kernel_size": 3}
+filter_cache = ResultCache(max_bytes=1024 ** 3)  # Filtered volumes of the current series, at most 1 GB
+filter_mode = "2d"  # "2d" filters every slice on its own, "3d" smooths across slices as well
+FILTER_WORKERS = os.cpu_count()  # Number of worker processes used for filtering
+filter_executor = None  # Process pool, created together with the UI
+filter_job = None  # Background FilterJob for the current filter settings, None if nothing is being computed
+refresh_after_id = None  # Pending debounced refresh
+REFRESH_DELAY_MS = 300  # Typing pause after which changed filter parameters are applied
+plane = "axial"  # Displayed plane, "axial", "coronal" or "sagittal"
 
 
 # Function that displays the DICOM images
 def display_dicom_image():
     directory = filedialog.askdirectory()
     if directory:
-        dicom_files = [os.path.join(directory, filename) for filename in os.listdir(directory) if filename.lower().endswith('.dcm')]
+        # Files of the largest series in the directory, in anatomical order (read from the headers only)
+        dicom_files, series = find_series_files(directory, progress=show_index_progress)
         if dicom_files:
-            dicom_files.sort()
             global ct_data, filtered_data
-            ct_data = load_ct_volume(dicom_files)
-            filtered_data = filter_ct_slices(ct_data, filter_type)
+            if ct_data is not None:
+                ct_data.close()  # Ends the prefetching of the previous series
+            ct_data = open_ct_volume(dicom_files, progress=show_load_progress)
+            filter_cache.clear()
+            renderer.reset()
+            # A lazy volume is sampled at its first slice only (a single decode), the window then grows with the displayed slices
+            renderer.set_window_from_volume(ct_data, n_samples=1 if ct_data.lazy else 16, grow=ct_data.lazy)
+            filtered_data = get_filtered_volume(0)
             display_slice(0, filtered_data)
-            slice_slider.config(to=len(filtered_data) - 1)
-            slice_label.config(text="")
+            slice_slider.config(to=plane_length(ct_data, plane) - 1)
+            slice_label.config(text="" if len(series) == 1 else f"{len(series)} series found, showing the largest one")
         else:
             slice_label.config(text="No DICOM files found in the selected directory")
 
 
-# Function that loads the CT volume (in the form of an entire folder)
-def load_ct_volume(dicom_files):
-    """Returns the DICOM images as a list of np.ndarrays"""
-    ct_slices = [pydicom.dcmread(file_path).pixel_array for file_path in dicom_files]
-    return ct_slices
+# Function that reports the header indexing progress in the status label
+def show_index_progress(done, total):
+    slice_label.config(text=f"Indexing file {done}/{total}")
+    app.update_idletasks()
+
+
+# Function that reports the loading progress in the status label
+def show_load_progress(done, total):
+    slice_label.config(text=f"Loading slice {done}/{total}")
+    app.update_idletasks()
+
+
+# Function that returns the cache key of the current filter settings
+def filter_cache_key():
+    """Returns (filter_type, gaussian_radius, gaussian_std, kernel_size, filter_mode) with unused parameters set to None."""
+    gaussian = filter_type == "gaussian"
+    kernel = filter_type in ["median", "average"]
+    return (filter_type,
+            filter_params["gaussian_radius"] if gaussian else None,
+            filter_params["gaussian_std"] if gaussian else None,
+            filter_params["kernel_size"] if kernel else None,
+            filter_mode)
 
 
-def filter_ct_slices(ct_slices, filter_type):
+# Function that returns the filtered volume, reusing earlier results for the same filter settings
+def get_filtered_volume(visible_slice):
     """
-    Applies the specified filter to each slice in a CT volume.
-
-    Parameters:
-        ct_slices (list or np.ndarray): The input CT slices as a list or array of 2D arrays (grayscale images).
-        filter_type (str): The type of filter to apply. Options include:
-            - "gaussian": Applies a Gaussian filter for smoothing the image.
-            - "median": Applies a median filter for reducing noise while preserving edges.
-            - "average": Applies an average (uniform) filter for smoothing the image by averaging the pixel values in a local neighborhood.
-
-    Returns:
-        np.ndarray: A NumPy array of filtered CT slices.
-
-    Filter Descriptions and Parameters:
-    -----------------------------------
-    1. **Gaussian Filter**:
-        - Smooths the image by applying a Gaussian kernel, which reduces noise and detail.
-        - Parameters:
-            - `sigma` (filter_params["gaussian_std"]): The standard deviation of the Gaussian kernel. Controls the degree of smoothing. Larger values result in more smoothing.
-            - `radius` (filter_params["gaussian_radius"]): Defines the extent of the kernel's area of influence. Affects how far the smoothing effect reaches.
-
-    2. **Median Filter**:
-        - Reduces noise in the image by replacing each pixel's value with the median of its neighbors. Useful for removing salt-and-pepper noise while preserving edges.
-        - Parameter:
-            - `size` (filter_params["kernel_size"]): The size of the neighborhood (kernel) used to calculate the median. Larger sizes lead to stronger noise reduction but may reduce image detail.
-
-    3. **Average (Uniform) Filter**:
-        - Applies a uniform filter where each pixel is replaced by the average of its neighbors. This smooths the image by averaging out local pixel values.
-        - Parameter:
-            - `size` (filter_params["kernel_size"]): The size of the neighborhood (kernel) over which the averaging is done. Larger sizes result in more extensive smoothing.
-
-    Note:
-        If `filter_type` is not recognized, the original `ct_slices` are returned without modification.
+    Returns the cached filtered volume for the current settings, or a FilterJob that behaves like it.
+
+    A new job filters the visible slice right away and the remaining slices on the worker pool. Any job
+    of previous (now stale) settings is cancelled.
     """
-    if filter_type == "gaussian":
-        return np.array([gaussian_filter(slice, sigma=filter_params["gaussian_std"], radius=filter_params["gaussian_radius"]) for slice in ct_slices])
-    elif filter_type == "median":
-        return np.array([median_filter(slice, size=filter_params["kernel_size"]) for slice in ct_slices])
-    elif filter_type == "average":
-        return np.array([uniform_filter(slice, size=filter_params["kernel_size"]) for slice in ct_slices])
-    return ct_slices  # Return unmodified if no filter is selected
+    global filter_job
+    if filter_job is not None:
+        filter_job.cancel()
+        filter_job = None
+    if filter_type not in FILTER_TYPES:
+        return ct_data
+    key = filter_cache_key()
+    filtered = filter_cache.get(key)
+    if filtered is None:
+        filter_job = FilterJob(ct_data, filter_type, filter_params, mode=filter_mode)
+        filter_job[visible_slice]  # Filter the slice on screen before anything else
+        filter_job.start(filter_executor, first=visible_slice)
+        app.after(100, poll_filter_job, filter_job, key)
+        return filter_job
+    filter_status_label.config(text=f"Filter cache: {filter_cache.stats()}")
+    return filtered
+
+
+# Function that checks on the background filter job and swaps in its result once it is complete
+def poll_filter_job(job, key):
+    global filtered_data, filter_executor
+    if job.cancelled:
+        return
+    if job.error is not None:
+        if isinstance(job.error, BrokenProcessPool):
+            # A crashed worker breaks the pool for good, the next job gets a new one
+            filter_executor.shutdown(wait=False, cancel_futures=True)
+            filter_executor = ProcessPoolExecutor(max_workers=FILTER_WORKERS)
+        filter_status_label.config(text=f"Background filtering failed ({job.error!r}), filtering visible slices only")
+        return
+    if not job.finished:
+        filter_status_label.config(text=f"Filtering in background: {job.n_done}/{len(job)} slices")
+        app.after(100, poll_filter_job, job, key)
+        return
+    filter_cache.put(key, job.output)
+    if filtered_data is job:
+        filtered_data = job.output
+        if plane != "axial":
+            display_slice(slice_slider.get(), filtered_data)  # Replace the unfiltered preview
+    filter_status_label.config(text=f"Filter cache: {filter_cache.stats()}")
 
 
 # Function that displays a single slice at a time
 def display_slice(slice_number, data):
-    ax.clear()
-    slice = data[slice_number]  # np.ndarray
-    ax.imshow(slice, cmap='gray')
-    canvas.draw()
-    slice_label.config(text=f"Slice {slice_number}/{len(data) - 1}")
+    if plane != "axial" and isinstance(data, FilterJob):
+        # Coronal and sagittal slices cut through every axial slice, so they show the unfiltered volume until the job is done
+        data = data.output if data.finished else ct_data
+    slice = plane_slice(data, plane, slice_number)  # np.ndarray, a strided view into the volume for coronal and sagittal
+    # Updates the persistent image and blits it instead of redrawing the whole figure, stretched to the voxel spacing
+    renderer.show(slice, aspect=plane_aspect(ct_data.spacing, plane))
+    slice_label.config(text=f"Slice {slice_number}/{plane_length(ct_data, plane) - 1}")
+    frame_time_label.config(text=renderer.frame_time_text())
+    if plane == "axial" and isinstance(data, CTVolume):
+        data.prefetch(slice_number)  # Decode the neighbouring slices while the user looks at this one
+
+
+# Function to switch between the axial, coronal and sagittal plane
+def update_plane(new_plane):
+    global plane
+    plane = new_plane
+    if 'ct_data' in globals() and ct_data is not None:
+        middle = plane_length(ct_data, plane) // 2
+        slice_slider.config(to=plane_length(ct_data, plane) - 1)
+        slice_slider.set(middle)
+        display_slice(middle, filtered_data)
 
 
 # Function to update the filter type and parameters
@@ -101,6 +160,13 @@ def update_filter_type(new_filter):
     refresh_images()
 
 
+# Function to switch between slice-wise (2D) and volumetric (3D) filtering
+def update_filter_mode(new_mode):
+    global filter_mode
+    filter_mode = new_mode
+    refresh_images()
+
+
 def update_filter_inputs():
     # Show or hide input fields based on the filter type
     if filter_type == "gaussian":
@@ -120,67 +186,102 @@ def update_param(param, value):
     if value == "":
         return
     filter_params[param] = int(value)
-    refresh_images()  # Reload and display images with updated parameters
+    if filter_job is not None:
+        filter_job.cancel()  # Stale right away, its workers need not keep running until the debounced refresh
+    schedule_refresh()  # Reload and display images with updated parameters once the user stops typing
+
+
+# Function that debounces refreshes, so each keystroke does not start a new filter job
+def schedule_refresh():
+    global refresh_after_id
+    if refresh_after_id is not None:
+        app.after_cancel(refresh_after_id)
+    refresh_after_id = app.after(REFRESH_DELAY_MS, refresh_images)
 
 
 def refresh_images():
     """Reapply the filter to the images and refresh the display."""
-    global filtered_data
-    if 'ct_data' in globals():
-        filtered_data = filter_ct_slices(ct_data, filter_type)
+    global filtered_data, refresh_after_id
+    refresh_after_id = None
+    if 'ct_data' in globals() and ct_data is not None:
+        # In the other planes there is no single axial slice on screen, the job starts in the middle of the volume
+        visible_slice = slice_slider.get() if plane == "axial" else len(ct_data) // 2
+        filtered_data = get_filtered_volume(visible_slice)
         display_slice(slice_slider.get(), filtered_data)
 
 
 # UI --- no need to touch this part (unless you want to make UI changes)
-app = tk.Tk()
-app.title("DICOM Viewer (noise suppression)")
-
-frame = ttk.Frame(app)
-frame.pack(expand=True, fill='both')
-display_button = ttk.Button(frame, text="Load DICOM", command=display_dicom_image)
-display_button.grid(row=0, column=0)
-
-# Dropdown menu for selecting the filter type
-filter_dropdown = ttk.Combobox(frame, values=["original", "gaussian", "median", "average"])
-filter_dropdown.current(0)
-filter_dropdown.bind("<<ComboboxSelected>>", lambda e: update_filter_type(filter_dropdown.get()))
-filter_dropdown.grid(row=1, column=0, sticky="ew")
-
-# Input fields for Gaussian parameters
-gaussian_frame = ttk.Frame(frame)
-ttk.Label(gaussian_frame, text="Gaussian Radius:").grid(row=0, column=0)
-gaussian_radius_entry = ttk.Entry(gaussian_frame)
-gaussian_radius_entry.insert(0, "3")
-gaussian_radius_entry.grid(row=0, column=1)
-gaussian_radius_entry.bind("<KeyRelease>", lambda e: update_param("gaussian_radius", gaussian_radius_entry.get()))
-
-ttk.Label(gaussian_frame, text="Gaussian Std:").grid(row=1, column=0)
-gaussian_std_entry = ttk.Entry(gaussian_frame)
-gaussian_std_entry.insert(0, "1")
-gaussian_std_entry.grid(row=1, column=1)
-gaussian_std_entry.bind("<KeyRelease>", lambda e: update_param("gaussian_std", gaussian_std_entry.get()))
-
-# Input fields for median and average kernel size
-kernel_frame = ttk.Frame(frame)
-ttk.Label(kernel_frame, text="Kernel Size:").grid(row=0, column=0)
-kernel_size_entry = ttk.Entry(kernel_frame)
-kernel_size_entry.insert(0, "3")
-kernel_size_entry.grid(row=0, column=1)
-kernel_size_entry.bind("<KeyRelease>", lambda e: update_param("kernel_size", kernel_size_entry.get()))
-
-# Hide input frames by default
-update_filter_inputs()
-
-fig = Figure(figsize=(5, 5), dpi=100)
-ax = fig.add_subplot(111)
-canvas = FigureCanvasTkAgg(fig, master=frame)
-canvas.get_tk_widget().grid(row=2, column=0)
-
-app.update()
-slice_slider = tk.Scale(frame, from_=0, to=0, orient="horizontal", length=app.winfo_width() - 2 * 20,
-                        command=lambda x: display_slice(slice_slider.get(), filtered_data))
-slice_slider.grid(row=3, column=0)
-slice_label = ttk.Label(frame, text="", foreground="black")
-slice_label.grid(row=5, column=0)
-
-app.mainloop()
+# The guard keeps the worker processes of the filter pool from opening windows when they import this script
+if __name__ == "__main__":
+    app = tk.Tk()
+    app.title("DICOM Viewer (noise suppression)")
+
+    frame = ttk.Frame(app)
+    frame.pack(expand=True, fill='both')
+    display_button = ttk.Button(frame, text="Load DICOM", command=display_dicom_image)
+    display_button.grid(row=0, column=0)
+
+    # Dropdown menus for selecting the filter type and whether it is applied per slice or to the whole volume
+    filter_frame = ttk.Frame(frame)
+    filter_frame.grid(row=1, column=0, sticky="ew")
+    filter_frame.columnconfigure(0, weight=1)
+    filter_dropdown = ttk.Combobox(filter_frame, values=["original", "gaussian", "median", "average"])
+    filter_dropdown.current(0)
+    filter_dropdown.bind("<<ComboboxSelected>>", lambda e: update_filter_type(filter_dropdown.get()))
+    filter_dropdown.grid(row=0, column=0, sticky="ew")
+    filter_mode_dropdown = ttk.Combobox(filter_frame, values=FILTER_MODES, width=4, state="readonly")
+    filter_mode_dropdown.current(FILTER_MODES.index(filter_mode))
+    filter_mode_dropdown.bind("<<ComboboxSelected>>", lambda e: update_filter_mode(filter_mode_dropdown.get()))
+    filter_mode_dropdown.grid(row=0, column=1)
+
+    # Dropdown menu for selecting the displayed plane
+    plane_dropdown = ttk.Combobox(filter_frame, values=PLANES, width=9, state="readonly")
+    plane_dropdown.current(PLANES.index(plane))
+    plane_dropdown.bind("<<ComboboxSelected>>", lambda e: update_plane(plane_dropdown.get()))
+    plane_dropdown.grid(row=0, column=2)
+
+    # Input fields for Gaussian parameters
+    gaussian_frame = ttk.Frame(frame)
+    ttk.Label(gaussian_frame, text="Gaussian Radius:").grid(row=0, column=0)
+    gaussian_radius_entry = ttk.Entry(gaussian_frame)
+    gaussian_radius_entry.insert(0, "3")
+    gaussian_radius_entry.grid(row=0, column=1)
+    gaussian_radius_entry.bind("<KeyRelease>", lambda e: update_param("gaussian_radius", gaussian_radius_entry.get()))
+
+    ttk.Label(gaussian_frame, text="Gaussian Std:").grid(row=1, column=0)
+    gaussian_std_entry = ttk.Entry(gaussian_frame)
+    gaussian_std_entry.insert(0, "1")
+    gaussian_std_entry.grid(row=1, column=1)
+    gaussian_std_entry.bind("<KeyRelease>", lambda e: update_param("gaussian_std", gaussian_std_entry.get()))
+
+    # Input fields for median and average kernel size
+    kernel_frame = ttk.Frame(frame)
+    ttk.Label(kernel_frame, text="Kernel Size:").grid(row=0, column=0)
+    kernel_size_entry = ttk.Entry(kernel_frame)
+    kernel_size_entry.insert(0, "3")
+    kernel_size_entry.grid(row=0, column=1)
+    kernel_size_entry.bind("<KeyRelease>", lambda e: update_param("kernel_size", kernel_size_entry.get()))
+
+    # Hide input frames by default
+    update_filter_inputs()
+
+    fig = Figure(figsize=(5, 5), dpi=100)
+    ax = fig.add_subplot(111)
+    canvas = FigureCanvasTkAgg(fig, master=frame)
+    canvas.get_tk_widget().grid(row=2, column=0)
+    renderer = SliceRenderer(canvas, ax)
+
+    app.update()
+    slice_slider = tk.Scale(frame, from_=0, to=0, orient="horizontal", length=app.winfo_width() - 2 * 20,
+                            command=lambda x: display_slice(slice_slider.get(), filtered_data))
+    slice_slider.grid(row=3, column=0)
+    slice_label = ttk.Label(frame, text="", foreground="black")
+    slice_label.grid(row=5, column=0)
+    filter_status_label = ttk.Label(frame, text="", foreground="gray")
+    filter_status_label.grid(row=6, column=0)
+    frame_time_label = ttk.Label(frame, text="", foreground="gray")
+    frame_time_label.grid(row=7, column=0)
+
+    filter_executor = ProcessPoolExecutor(max_workers=FILTER_WORKERS)
+    app.mainloop()
+    filter_executor.shutdown(wait=False, cancel_futures=True)
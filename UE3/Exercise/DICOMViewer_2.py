@@ -1,39 +1,57 @@
 import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog
-import pydicom
-import os
+import threading
 
 import scipy.ndimage
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
-from scipy.ndimage import zoom
+
+from dicom_index import find_series_files
+from dicom_volume import open_ct_volume
+from planes import PLANES, plane_aspect, plane_length, plane_slice
+from resampling import ResampledSlices, ResamplingEngine
+from slice_renderer import SliceRenderer
 
 ct_data = None
 filtered_data = None
 interpolation_method = "bicubic"
+zoom_factor = 4
+resampler = None  # ResamplingEngine of the loaded series, caches the results of every interpolation method
+plane = "axial"  # Displayed plane, "axial", "coronal" or "sagittal"
 
 
 # Function that displays the DICOM images
 def display_dicom_image():
     directory = filedialog.askdirectory()
     if directory:
-        dicom_files = [os.path.join(directory, filename) for filename in os.listdir(directory) if filename.lower().endswith('.dcm')]
+        # Files of the largest series in the directory, in anatomical order (read from the headers only)
+        dicom_files, series = find_series_files(directory, progress=show_index_progress)
         if dicom_files:
-            dicom_files.sort()
-            global ct_data, filtered_data
-            ct_data = load_ct_volume(dicom_files)
+            global ct_data, filtered_data, resampler
+            if ct_data is not None:
+                ct_data.close()  # Ends the prefetching of the previous series
+            ct_data = open_ct_volume(dicom_files, progress=show_load_progress)
+            resampler = ResamplingEngine(ct_data, zoom_factor)
+            renderer.reset()
+            renderer.set_window_from_volume(ct_data)
             refresh_images()
-            slice_slider.config(to=len(ct_data) - 1)
-            slice_label.config(text="")
+            slice_slider.config(to=plane_length(ct_data, plane) - 1)
+            slice_label.config(text="" if len(series) == 1 else f"{len(series)} series found, showing the largest one")
         else:
             slice_label.config(text="No DICOM files found in the selected directory")
 
 
-# Function that loads the CT volume (in the form of an entire folder)
-def load_ct_volume(dicom_files):
-    ct_slices = [pydicom.dcmread(file_path).pixel_array for file_path in dicom_files]
-    return ct_slices
+# Function that reports the header indexing progress in the status label
+def show_index_progress(done, total):
+    slice_label.config(text=f"Indexing file {done}/{total}")
+    app.update_idletasks()
+
+
+# Function that reports the loading progress in the status label
+def show_load_progress(done, total):
+    slice_label.config(text=f"Loading slice {done}/{total}")
+    app.update_idletasks()
 
 
 # Function to update interpolation method
@@ -43,56 +61,97 @@ def update_interpolation_method(new_method):
     refresh_images()
 
 
-# Function to resample a single image slice
-def resample_image(slice, zoom_factor, method):
-    order = {"nearest": 0, "bilinear": 1, "bicubic": 3}.get(method, 3)  # Default to bicubic
-    return zoom(zoom(slice, 1 / zoom_factor, order=order), zoom_factor, order=order)
-
-
 # Update refresh_images to include resampling
 def refresh_images():
     """Reapply the filter to the images and refresh the display."""
     global filtered_data
     if 'ct_data' in globals() and ct_data is not None:
-        zoom_factor = 4
-        filtered_data = [resample_image(slice, zoom_factor, interpolation_method) for slice in ct_data]
+        if resampler.is_resampled(interpolation_method):
+            filtered_data = resampler.resampled(interpolation_method)
+        elif resampler.fits_cache():
+            # Resample the visible slice on its own right away and the whole volume in the background
+            filtered_data = ResampledSlices(resampler, interpolation_method)
+            threading.Thread(target=resampler.resampled, args=(interpolation_method,), daemon=True).start()
+            app.after(100, poll_resampling, resampler, interpolation_method)
+        else:
+            # Too large to keep, resample every displayed slice from the downsampled level instead
+            filtered_data = ResampledSlices(resampler, interpolation_method)
+            threading.Thread(target=resampler.downsampled, args=(interpolation_method,), daemon=True).start()
         display_slice(slice_slider.get())
 
 
+# Function that swaps in the resampled volume once the background computation is done
+def poll_resampling(engine, method):
+    global filtered_data
+    if engine is not resampler or method != interpolation_method:
+        return  # Stale, the result stays cached in its engine
+    if not engine.is_resampled(method):
+        app.after(100, poll_resampling, engine, method)
+        return
+    filtered_data = engine.resampled(method)
+    if plane != "axial":
+        display_slice(slice_slider.get())  # Replace the original preview
+
+
 # Function that displays a single slice at a time
 def display_slice(slice_number):
-    ax.clear()
-    slice = filtered_data[slice_number]
-    ax.imshow(slice, cmap='gray')
-    canvas.draw()
-    slice_label.config(text=f"Slice {slice_number}/{len(filtered_data) - 1}")
+    data = filtered_data
+    if plane != "axial" and isinstance(data, ResampledSlices):
+        data = ct_data  # Coronal and sagittal slices need the whole resampled volume, show the original until it is done
+    slice = plane_slice(data, plane, slice_number)  # A strided view into the volume for coronal and sagittal
+    # Updates the persistent image and blits it instead of redrawing the whole figure, stretched to the voxel spacing
+    renderer.show(slice, aspect=plane_aspect(ct_data.spacing, plane))
+    slice_label.config(text=f"Slice {slice_number}/{plane_length(ct_data, plane) - 1}")
+    frame_time_label.config(text=renderer.frame_time_text())
+
+
+# Function to switch between the axial, coronal and sagittal plane
+def update_plane(new_plane):
+    global plane
+    plane = new_plane
+    if 'ct_data' in globals() and ct_data is not None:
+        middle = plane_length(ct_data, plane) // 2
+        slice_slider.config(to=plane_length(ct_data, plane) - 1)
+        slice_slider.set(middle)
+        display_slice(middle)
 
 
 # UI --- no need to touch this part (unless you want to make UI changes)
-app = tk.Tk()
-app.title("DICOM Viewer (resampling)")
-
-frame = ttk.Frame(app)
-frame.pack(expand=True, fill='both')
-display_button = ttk.Button(frame, text="Load DICOM", command=display_dicom_image)
-display_button.grid(row=0, column=0)
-
-# Dropdown for selecting interpolation method
-interpolation_dropdown = ttk.Combobox(frame, values=["nearest", "bilinear", "bicubic"])
-interpolation_dropdown.current(2)  # Default to "bicubic"
-interpolation_dropdown.bind("<<ComboboxSelected>>", lambda e: update_interpolation_method(interpolation_dropdown.get()))
-interpolation_dropdown.grid(row=1, column=0, sticky="ew")
-
-fig = Figure(figsize=(5, 5), dpi=100)
-ax = fig.add_subplot(111)
-canvas = FigureCanvasTkAgg(fig, master=frame)
-canvas.get_tk_widget().grid(row=2, column=0)
-
-app.update()
-slice_slider = tk.Scale(frame, from_=0, to=0, orient="horizontal", length=app.winfo_width() - 2 * 20,
-                        command=lambda x: display_slice(slice_slider.get()))
-slice_slider.grid(row=3, column=0)
-slice_label = ttk.Label(frame, text="", foreground="black")
-slice_label.grid(row=5, column=0)
-
-app.mainloop()
+# The guard lets batch tools import this script without opening a window
+if __name__ == "__main__":
+    app = tk.Tk()
+    app.title("DICOM Viewer (resampling)")
+
+    frame = ttk.Frame(app)
+    frame.pack(expand=True, fill='both')
+    display_button = ttk.Button(frame, text="Load DICOM", command=display_dicom_image)
+    display_button.grid(row=0, column=0)
+
+    # Dropdown for selecting interpolation method
+    interpolation_dropdown = ttk.Combobox(frame, values=["nearest", "bilinear", "bicubic"])
+    interpolation_dropdown.current(2)  # Default to "bicubic"
+    interpolation_dropdown.bind("<<ComboboxSelected>>", lambda e: update_interpolation_method(interpolation_dropdown.get()))
+    interpolation_dropdown.grid(row=1, column=0, sticky="ew")
+
+    # Dropdown for selecting the displayed plane
+    plane_dropdown = ttk.Combobox(frame, values=PLANES, state="readonly")
+    plane_dropdown.current(PLANES.index(plane))
+    plane_dropdown.bind("<<ComboboxSelected>>", lambda e: update_plane(plane_dropdown.get()))
+    plane_dropdown.grid(row=4, column=0, sticky="ew")
+
+    fig = Figure(figsize=(5, 5), dpi=100)
+    ax = fig.add_subplot(111)
+    canvas = FigureCanvasTkAgg(fig, master=frame)
+    canvas.get_tk_widget().grid(row=2, column=0)
+    renderer = SliceRenderer(canvas, ax)
+
+    app.update()
+    slice_slider = tk.Scale(frame, from_=0, to=0, orient="horizontal", length=app.winfo_width() - 2 * 20,
+                            command=lambda x: display_slice(slice_slider.get()))
+    slice_slider.grid(row=3, column=0)
+    slice_label = ttk.Label(frame, text="", foreground="black")
+    slice_label.grid(row=5, column=0)
+    frame_time_label = ttk.Label(frame, text="", foreground="gray")
+    frame_time_label.grid(row=6, column=0)
+
+    app.mainloop()
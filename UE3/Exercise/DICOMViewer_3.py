@@ -0,0 +1,342 @@
+import tkinter as tk
+from tkinter import ttk
+from tkinter import filedialog
+import threading
+import time
+
+import numpy as np
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
+
+from dicom_index import find_series_files
+from dicom_volume import open_ct_volume
+from planes import PLANES, plane_aspect, plane_length, plane_slice, plane_voxel
+from segmentation import NEIGHBORHOODS, RegionGrower, ThresholdIndex, threshold_mask
+from slice_renderer import SliceRenderer
+
+ct_data = None
+MODES = ["region growing", "threshold"]
+mode = "region growing"
+plane = "axial"  # Displayed plane, "axial", "coronal" or "sagittal"
+seeds = []  # Seed voxels as (slice, row, col)
+interval_percent = 4.23  # Half width of the threshold interval in % of the value range, as in UE3-ImageSegmentation-RegionGrowing.mlab
+connectivity = 6
+grower = None  # RegionGrower of the loaded series, keeps the labels of the last threshold interval
+segmentation = None  # Boolean mask of the grown region, None if there is none
+grow_generation = 0  # Incremented for every grow request, results of older requests are dropped
+threshold_index = None  # ThresholdIndex of the loaded series, built in the background on demand
+threshold_index_volume = None  # Volume whose threshold index is built or being built
+threshold_hu = [200, 3000]  # Lower and upper threshold in HU
+
+
+# Function that displays the DICOM images
+def display_dicom_image():
+    directory = filedialog.askdirectory()
+    if directory:
+        # Files of the largest series in the directory, in anatomical order (read from the headers only)
+        dicom_files, series = find_series_files(directory, progress=show_index_progress)
+        if dicom_files:
+            global ct_data, grower, threshold_index
+            if ct_data is not None:
+                ct_data.close()  # Ends the prefetching of the previous series
+            ct_data = open_ct_volume(dicom_files, progress=show_load_progress)
+            grower = None
+            threshold_index = None
+            if not ct_data.lazy or mode == "threshold":
+                # A cached volume is indexed right away, a lazy one only once thresholding needs it
+                start_threshold_index(ct_data)
+            renderer.reset()
+            # A lazy volume is sampled at its first slice only (a single decode), the window then grows with the displayed slices
+            renderer.set_window_from_volume(ct_data, n_samples=1 if ct_data.lazy else 16, grow=ct_data.lazy)
+            slice_slider.config(to=plane_length(ct_data, plane) - 1)
+            clear_seeds()  # Also displays the slice
+            slice_label.config(text="" if len(series) == 1 else f"{len(series)} series found, showing the largest one")
+        else:
+            slice_label.config(text="No DICOM files found in the selected directory")
+
+
+# Function that reports the header indexing progress in the status label
+def show_index_progress(done, total):
+    slice_label.config(text=f"Indexing file {done}/{total}")
+    app.update_idletasks()
+
+
+# Function that reports the loading progress in the status label
+def show_load_progress(done, total):
+    slice_label.config(text=f"Loading slice {done}/{total}")
+    app.update_idletasks()
+
+
+# Function that adds the clicked voxel as a seed and grows the region again
+def on_click(event):
+    if ct_data is None or mode != "region growing" or event.inaxes is not ax or event.xdata is None:
+        return
+    slice_shape = plane_slice(ct_data, plane, slice_slider.get()).shape
+    row, col = int(round(event.ydata)), int(round(event.xdata))
+    if not (0 <= row < slice_shape[0] and 0 <= col < slice_shape[1]):
+        return
+    seeds.append(plane_voxel(plane, slice_slider.get(), row, col))
+    start_growing()
+
+
+# Function that grows the region from the current seeds in a background thread
+def start_growing():
+    global grow_generation
+    grow_generation += 1
+    if not seeds or ct_data is None:
+        return
+    generation = grow_generation
+    volume, region_grower, grow_seeds, neighbours = ct_data, grower, list(seeds), connectivity
+    result = {}
+
+    def grow():
+        # The first grower of a series needs the whole volume, which may still have to be decoded (or is being
+        # decoded for the threshold index), so it is built here and not on the UI thread
+        result["grower"] = region_grower or RegionGrower(volume, neighbours)
+        start = time.perf_counter()
+        result["mask"], result["lower"], result["upper"] = result["grower"].grow_from_seed(grow_seeds, interval_percent)
+        result["elapsed"] = time.perf_counter() - start
+
+    thread = threading.Thread(target=grow, daemon=True)
+    thread.start()
+    segmentation_label.config(text=f"Growing from {len(seeds)} seed(s)...")
+    app.after(50, poll_growing, thread, generation, result)
+
+
+# Function that shows the grown region once the background thread is done
+def poll_growing(thread, generation, result):
+    global segmentation, grower
+    if generation != grow_generation:
+        return  # Stale, seeds or parameters changed in the meantime
+    if thread.is_alive():
+        app.after(50, poll_growing, thread, generation, result)
+        return
+    if grower is None and "grower" in result:
+        grower = result["grower"]  # Reused by the next grow, keeps the labels of the last threshold interval
+    if "mask" not in result:
+        segmentation_label.config(text="Region growing failed")
+        return
+    segmentation = result["mask"]
+    n_voxels = int(np.count_nonzero(segmentation))
+    volume_ml = n_voxels * np.prod(ct_data.spacing) / 1000
+    lower_hu, upper_hu = (value * ct_data.slope + ct_data.intercept for value in (result["lower"], result["upper"]))
+    segmentation_label.config(text=f"{n_voxels} voxels ({volume_ml:.1f} ml), HU [{lower_hu:.0f}, {upper_hu:.0f}], "
+                                   f"grown in {1000 * result['elapsed']:.0f} ms")
+    display_slice(slice_slider.get())
+
+
+# Function that removes all seeds and the grown region
+def clear_seeds():
+    global segmentation, grow_generation
+    seeds.clear()
+    segmentation = None
+    grow_generation += 1
+    if mode == "region growing":
+        segmentation_label.config(text="Click into the image to place a seed")
+    if ct_data is not None:
+        display_slice(slice_slider.get())
+
+
+# Function that builds the threshold index of a volume in a background thread, once per volume
+def start_threshold_index(volume):
+    global threshold_index_volume
+    if volume is threshold_index_volume:
+        return
+    threshold_index_volume = volume
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("index", ThresholdIndex(volume)), daemon=True)
+    thread.start()
+    app.after(100, poll_threshold_index, thread, volume, result)
+
+
+# Function that takes over the threshold index once it is built
+def poll_threshold_index(thread, volume, result):
+    global threshold_index
+    if volume is not ct_data:
+        return  # Another series was loaded in the meantime
+    if thread.is_alive():
+        app.after(100, poll_threshold_index, thread, volume, result)
+        return
+    threshold_index = result.get("index")
+    if threshold_index is None:
+        segmentation_label.config(text="Could not build the threshold index")
+        return
+    # The sliders cover the value range of the series in HU
+    low, high = threshold_index.offset, threshold_index.offset + threshold_index.n_bins - 1
+    low_hu, high_hu = sorted(value * volume.slope + volume.intercept for value in (low, high))
+    for slider in (lower_slider, upper_slider):
+        slider.config(from_=low_hu, to=high_hu)
+    update_threshold()
+
+
+# Function that returns the threshold interval in stored values
+def threshold_stored():
+    return sorted(float(ct_data.to_stored(value)) for value in threshold_hu)
+
+
+# Function that reads the threshold sliders, reports the thresholded volume and redraws
+def update_threshold(*args):
+    threshold_hu[:] = sorted((lower_slider.get(), upper_slider.get()))
+    if mode != "threshold" or ct_data is None:
+        return
+    if threshold_index is None:
+        start_threshold_index(ct_data)  # Decodes the whole series, so a lazy volume is only indexed here
+        segmentation_label.config(text="Building the threshold index...")
+    else:
+        n_voxels = threshold_index.count(*threshold_stored())  # O(1) from the cumulative histogram
+        volume_ml = n_voxels * np.prod(ct_data.spacing) / 1000
+        segmentation_label.config(text=f"{n_voxels} voxels ({volume_ml:.1f} ml) in HU [{threshold_hu[0]:.0f}, {threshold_hu[1]:.0f}]")
+    display_slice(slice_slider.get())
+
+
+# Function that saves the current segmentation as a 3D boolean .npy mask
+def export_mask():
+    if mode == "threshold":
+        if threshold_index is None:
+            return
+        mask = threshold_index.mask(*threshold_stored())  # The only time the full thresholded mask is built
+    else:
+        if segmentation is None:
+            return
+        mask = segmentation
+    path = filedialog.asksaveasfilename(defaultextension=".npy", filetypes=[("NumPy array", "*.npy")])
+    if path:
+        np.save(path, mask)
+        segmentation_label.config(text=f"Saved {int(np.count_nonzero(mask))} voxels to {path}")
+
+
+# Function to switch between region growing and thresholding
+def update_mode(new_mode):
+    global mode
+    mode = new_mode
+    if mode == "threshold":
+        growing_frame.grid_remove()
+        threshold_frame.grid(row=4, column=0, sticky="ew")
+        update_threshold()
+    else:
+        threshold_frame.grid_remove()
+        growing_frame.grid(row=4, column=0, sticky="ew")
+        segmentation_label.config(text="Click into the image to place a seed")
+        if ct_data is not None:
+            display_slice(slice_slider.get())
+
+
+# Function to update the threshold interval
+def update_interval(value):
+    global interval_percent
+    try:
+        interval_percent = float(value)
+    except ValueError:
+        return
+    start_growing()
+
+
+# Function to update the voxel neighbourhood
+def update_connectivity(value):
+    global connectivity, grower
+    connectivity = int(value)
+    if grower is not None:
+        grower = RegionGrower(grower.volume, connectivity)
+    start_growing()  # Also drops a grow that is still running with the previous connectivity
+
+
+# Function to switch between the axial, coronal and sagittal plane
+def update_plane(new_plane):
+    global plane
+    plane = new_plane
+    if ct_data is not None:
+        middle = plane_length(ct_data, plane) // 2
+        slice_slider.config(to=plane_length(ct_data, plane) - 1)
+        slice_slider.set(middle)
+        display_slice(middle)
+
+
+# Function that displays a single slice at a time with the segmentation on top
+def display_slice(slice_number):
+    if ct_data is None:
+        return
+    slice = plane_slice(ct_data, plane, slice_number)
+    if mode == "threshold":
+        mask = threshold_mask(slice, *threshold_stored())  # Only the visible slice is thresholded
+    else:
+        mask = plane_slice(segmentation, plane, slice_number) if segmentation is not None else None
+    renderer.show(slice, aspect=plane_aspect(ct_data.spacing, plane), mask=mask)
+    slice_label.config(text=f"Slice {slice_number}/{plane_length(ct_data, plane) - 1}")
+    frame_time_label.config(text=renderer.frame_time_text())
+    if plane == "axial":
+        ct_data.prefetch(slice_number)
+
+
+# UI --- no need to touch this part (unless you want to make UI changes)
+if __name__ == "__main__":
+    app = tk.Tk()
+    app.title("DICOM Viewer (segmentation)")
+
+    frame = ttk.Frame(app)
+    frame.pack(expand=True, fill='both')
+    display_button = ttk.Button(frame, text="Load DICOM", command=display_dicom_image)
+    display_button.grid(row=0, column=0)
+
+    # Segmentation mode, displayed plane and export of the segmentation
+    mode_frame = ttk.Frame(frame)
+    mode_frame.grid(row=1, column=0, sticky="ew")
+    mode_frame.columnconfigure(0, weight=1)
+    mode_dropdown = ttk.Combobox(mode_frame, values=MODES, state="readonly")
+    mode_dropdown.current(MODES.index(mode))
+    mode_dropdown.bind("<<ComboboxSelected>>", lambda e: update_mode(mode_dropdown.get()))
+    mode_dropdown.grid(row=0, column=0, sticky="ew")
+    plane_dropdown = ttk.Combobox(mode_frame, values=PLANES, width=9, state="readonly")
+    plane_dropdown.current(PLANES.index(plane))
+    plane_dropdown.bind("<<ComboboxSelected>>", lambda e: update_plane(plane_dropdown.get()))
+    plane_dropdown.grid(row=0, column=1)
+    export_button = ttk.Button(mode_frame, text="Export mask", command=export_mask)
+    export_button.grid(row=0, column=2)
+
+    # Region growing parameters: threshold interval and neighbourhood
+    growing_frame = ttk.Frame(frame)
+    ttk.Label(growing_frame, text="Interval (%):").grid(row=0, column=0)
+    interval_entry = ttk.Entry(growing_frame, width=6)
+    interval_entry.insert(0, str(interval_percent))
+    interval_entry.bind("<Return>", lambda e: update_interval(interval_entry.get()))
+    interval_entry.bind("<FocusOut>", lambda e: update_interval(interval_entry.get()))
+    interval_entry.grid(row=0, column=1)
+    ttk.Label(growing_frame, text="Neighbours:").grid(row=0, column=2)
+    connectivity_dropdown = ttk.Combobox(growing_frame, values=list(NEIGHBORHOODS), width=3, state="readonly")
+    connectivity_dropdown.current(list(NEIGHBORHOODS).index(connectivity))
+    connectivity_dropdown.bind("<<ComboboxSelected>>", lambda e: update_connectivity(connectivity_dropdown.get()))
+    connectivity_dropdown.grid(row=0, column=3)
+    clear_button = ttk.Button(growing_frame, text="Clear seeds", command=clear_seeds)
+    clear_button.grid(row=0, column=4)
+    growing_frame.grid(row=4, column=0, sticky="ew")
+
+    # Threshold sliders in HU
+    threshold_frame = ttk.Frame(frame)
+    threshold_frame.columnconfigure(1, weight=1)
+    ttk.Label(threshold_frame, text="Lower (HU):").grid(row=0, column=0)
+    lower_slider = tk.Scale(threshold_frame, from_=-1024, to=3071, orient="horizontal", command=update_threshold)
+    lower_slider.set(threshold_hu[0])
+    lower_slider.grid(row=0, column=1, sticky="ew")
+    ttk.Label(threshold_frame, text="Upper (HU):").grid(row=1, column=0)
+    upper_slider = tk.Scale(threshold_frame, from_=-1024, to=3071, orient="horizontal", command=update_threshold)
+    upper_slider.set(threshold_hu[1])
+    upper_slider.grid(row=1, column=1, sticky="ew")
+
+    fig = Figure(figsize=(5, 5), dpi=100)
+    ax = fig.add_subplot(111)
+    canvas = FigureCanvasTkAgg(fig, master=frame)
+    canvas.get_tk_widget().grid(row=2, column=0)
+    canvas.mpl_connect("button_press_event", on_click)
+    renderer = SliceRenderer(canvas, ax)
+
+    app.update()
+    slice_slider = tk.Scale(frame, from_=0, to=0, orient="horizontal", length=app.winfo_width() - 2 * 20,
+                            command=lambda x: display_slice(slice_slider.get()))
+    slice_slider.grid(row=3, column=0)
+    slice_label = ttk.Label(frame, text="", foreground="black")
+    slice_label.grid(row=5, column=0)
+    segmentation_label = ttk.Label(frame, text="Click into the image to place a seed", foreground="gray")
+    segmentation_label.grid(row=6, column=0)
+    frame_time_label = ttk.Label(frame, text="", foreground="gray")
+    frame_time_label.grid(row=7, column=0)
+
+    app.mainloop()
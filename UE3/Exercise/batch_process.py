@@ -0,0 +1,207 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pydicom
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+from ct_filters import FILTER_MODES, FILTER_TYPES, filter_range
+from dicom_index import DicomIndex, find_series_files
+from dicom_volume import load_ct_volume
+from resampling import INTERPOLATION_ORDERS, interpolation_order, resampled_shape, zoom_slices
+
+
+def find_series(paths, workers=None):
+    """
+    Returns the directories that contain DICOM files: the given paths themselves or their direct subdirectories.
+
+    Files are recognized by their headers (see DicomIndex), like in the viewers, so series without a .dcm
+    extension are found as well.
+    """
+    series = []
+    for path in paths:
+        path = os.path.abspath(path)
+        with DicomIndex(path) as index:
+            index.scan(workers=workers)
+            directories = index.directories()
+        if path in directories:
+            series.append(path)
+            continue
+        # Direct subdirectories with DICOM files anywhere below them
+        subdirectories = {os.path.join(path, os.path.relpath(directory, path).split(os.sep)[0]) for directory in directories}
+        series.extend(sorted(subdirectories))
+    return series
+
+
+def process_series(directory, output_dir, options):
+    """
+    Loads, filters, resamples and writes one DICOM series.
+
+    The volume is processed in slabs of consecutive slices (in "3d" filter mode with a halo of neighbouring
+    slices), each slab is written as soon as it is done. Returns the elapsed seconds per stage.
+    """
+    # Stages that are not requested stay None and are reported as skipped
+    timings = {"load": 0.0, "filter": 0.0 if options.filter else None, "resample": 0.0 if options.resample else None, "write": 0.0}
+    name = os.path.basename(os.path.normpath(directory))
+    dicom_files, _ = find_series_files(directory, workers=options.threads)  # Largest series, in anatomical order
+
+    start = time.perf_counter()
+    volume = load_ct_volume(dicom_files, workers=options.threads)
+    timings["load"] = time.perf_counter() - start
+
+    # Resampling rounds the slice size (e.g. 512 -> 513 for a zoom factor of 3), the output is sized accordingly
+    shape = resampled_shape(volume.shape, options.zoom_factor) if options.resample else volume.shape
+    if options.format == "npy":
+        writer = NpyWriter(output_dir, name, shape, volume.dtype)
+    else:
+        writer = DicomWriter(output_dir, name, dicom_files, scale=np.divide(volume.shape[1:], shape[1:]), verify=options.verify)
+    params = {"gaussian_radius": options.gaussian_radius, "gaussian_std": options.gaussian_std, "kernel_size": options.kernel_size}
+    for slab_start in range(0, len(volume), options.slab_size):
+        slab_stop = min(slab_start + options.slab_size, len(volume))
+
+        slab = volume[slab_start:slab_stop]
+        if options.filter:
+            start = time.perf_counter()
+            slab = filter_range(volume, slab_start, slab_stop, options.filter, params, options.filter_mode)
+            timings["filter"] += time.perf_counter() - start
+
+        if options.resample:
+            start = time.perf_counter()
+            order = interpolation_order(options.resample)
+            slab = zoom_slices(zoom_slices(slab, 1 / options.zoom_factor, order), options.zoom_factor, order)
+            timings["resample"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        writer.write(slab_start, slab)
+        timings["write"] += time.perf_counter() - start
+    writer.close()
+    return name, len(volume), timings
+
+
+class NpyWriter:
+    """Streams slabs into a memory-mapped <name>.npy file."""
+
+    def __init__(self, output_dir, name, shape, dtype):
+        self.path = os.path.join(output_dir, f"{name}.npy")
+        self.output = np.lib.format.open_memmap(self.path, mode="w+", dtype=dtype, shape=shape)
+
+    def write(self, start, slab):
+        self.output[start:start + len(slab)] = slab
+
+    def close(self):
+        self.output.flush()
+        del self.output
+
+
+class DicomWriter:
+    """
+    Writes every processed slice as an uncompressed DICOM file into <name>/, copying the header of its source file.
+
+    scale is the (row, column) factor between the input and the output pixel size, e.g. for resampled slices
+    with a rounded size. The PixelSpacing is multiplied by it, so the series still covers the same area. The
+    slices themselves are never resampled, so SliceThickness and the slice positions are kept. With verify
+    every file is read back with pydicom after writing and compared with the slice it was written from.
+    """
+
+    def __init__(self, output_dir, name, dicom_files, scale=(1.0, 1.0), verify=False):
+        self.directory = os.path.join(output_dir, name)
+        os.makedirs(self.directory, exist_ok=True)
+        self.dicom_files = dicom_files
+        self.scale = scale
+        self.verify = verify
+        self.series_uid = generate_uid()
+
+    def write(self, start, slab):
+        for index, pixels in enumerate(slab, start=start):
+            ds = pydicom.dcmread(self.dicom_files[index])
+            ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+            if int(pydicom.__version__.split(".")[0]) < 3:
+                ds.is_little_endian, ds.is_implicit_VR = True, False  # pydicom 2 encodes by these flags, not the transfer syntax
+            ds.Rows, ds.Columns = pixels.shape
+            if "PixelSpacing" in ds:
+                ds.PixelSpacing = [round(float(spacing) * scale, 6) for spacing, scale in zip(ds.PixelSpacing, self.scale)]
+            # The pixel format follows the written dtype: the source header may describe e.g. 12 stored bits,
+            # which would cut off every value above 2047 of an int16 volume
+            ds.BitsAllocated = ds.BitsStored = pixels.dtype.itemsize * 8
+            ds.HighBit = ds.BitsStored - 1
+            ds.PixelRepresentation = 1 if pixels.dtype.kind == "i" else 0
+            ds.PixelData = np.ascontiguousarray(pixels).tobytes()
+            ds.SeriesInstanceUID = self.series_uid
+            ds.SOPInstanceUID = generate_uid()
+            ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+            ds.SeriesDescription = f"{ds.get('SeriesDescription', '')} (processed)".strip()
+            path = os.path.join(self.directory, os.path.basename(self.dicom_files[index]))
+            ds.save_as(path)
+            if self.verify and not np.array_equal(pydicom.dcmread(path).pixel_array, pixels):
+                raise ValueError(f"{path} does not read back the values that were written")
+
+    def close(self):
+        pass
+
+
+def print_throughput(name, n_slices, timings):
+    stages = " | ".join(f"{stage} {seconds:.2f} s ({n_slices / max(seconds, 1e-9):.0f} slices/s)" if seconds is not None
+                        else f"{stage} skipped" for stage, seconds in timings.items())
+    print(f"{name} ({n_slices} slices): {stages}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Filter and resample DICOM series without a display")
+    parser.add_argument("paths", nargs="+", help="Series directories, or directories whose subdirectories are series (e.g. Datasets_UE3)")
+    parser.add_argument("--output", default="batch_output", help="Output directory (default: batch_output)")
+    parser.add_argument("--format", choices=["npy", "dicom"], default="npy", help="Write one .npy volume or a DICOM series per input series")
+    parser.add_argument("--verify", action="store_true", help="Read every written DICOM file back and compare it with the written slice")
+    parser.add_argument("--filter", choices=FILTER_TYPES, help="Noise suppression filter (default: none)")
+    parser.add_argument("--filter-mode", choices=FILTER_MODES, default="2d", help="Filter each slice (2d) or the volume (3d)")
+    parser.add_argument("--gaussian-radius", type=int, default=3)
+    parser.add_argument("--gaussian-std", type=float, default=1)
+    parser.add_argument("--kernel-size", type=int, default=3)
+    parser.add_argument("--resample", choices=list(INTERPOLATION_ORDERS), help="Interpolation method for down- and upsampling (default: none)")
+    parser.add_argument("--zoom-factor", type=float, default=4)
+    parser.add_argument("--slab-size", type=int, default=16, help="Slices processed and written at once")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Series processed in parallel worker processes")
+    parser.add_argument("--threads", type=int, default=1, help="Decoding threads per worker process")
+    options = parser.parse_args()
+
+    series = find_series(options.paths, workers=options.threads)
+    if not series:
+        parser.error("No DICOM series found")
+    os.makedirs(options.output, exist_ok=True)
+
+    start = time.perf_counter()
+    totals = None
+    total_slices = 0
+    failed = []
+    with ProcessPoolExecutor(max_workers=min(options.workers, len(series))) as executor:
+        futures = {executor.submit(process_series, directory, options.output, options): directory for directory in series}
+        for future in as_completed(futures):
+            try:
+                name, n_slices, timings = future.result()
+            except Exception as e:  # One broken series must not cost the results of all others
+                failed.append(futures[future])
+                print(f"{futures[future]}: failed ({type(e).__name__}: {e})")
+                continue
+            print_throughput(name, n_slices, timings)
+            total_slices += n_slices
+            totals = timings if totals is None else {stage: None if seconds is None else totals[stage] + seconds
+                                                     for stage, seconds in timings.items()}
+    elapsed = time.perf_counter() - start
+    if totals is not None:
+        print_throughput("Total (summed over workers)", total_slices, totals)
+    print(f"Processed {len(series) - len(failed)} series in {elapsed:.2f} s ({total_slices / elapsed:.0f} slices/s wall clock)")
+    if failed:
+        print(f"{len(failed)} series failed: {', '.join(failed)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
+
+# Example usage:
+# Median filter and bicubic resampling of every series in Datasets_UE3, written as .npy volumes:
+# python batch_process.py Datasets_UE3 --filter median --kernel-size 5 --resample bicubic
+#
+# Volumetric gaussian filter of a single series, written as a new DICOM series:
+# python batch_process.py Datasets_UE3/Lungs --filter gaussian --filter-mode 3d --format dicom
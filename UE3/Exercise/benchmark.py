@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker
+
+import numpy as np
+import psutil
+import scipy
+
+from ct_filters import FILTER_TYPES, filter_volume
+from dicom_index import find_series_files
+from dicom_volume import load_cached_volume, load_ct_volume
+from resampling import INTERPOLATION_ORDERS, ResamplingEngine
+
+DATASETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Datasets_UE3")
+DATASETS = ["Aneurysm", "HeadNeck", "Lungs"]
+FILTER_PARAMS = {"gaussian_radius": 3, "gaussian_std": 1, "kernel_size": 3}
+
+
+class PeakMemory:
+    """Samples the resident memory of this process and its worker processes while a stage runs."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self):
+        self.peak = self._rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+    def _rss(self):
+        rss = self._process.memory_info().rss
+        for child in self._process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except psutil.Error:
+                pass  # The worker exited between listing and sampling
+        return rss
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._rss())
+
+
+def run_stage(results, dataset, stage, variant, n_slices, function, repeat):
+    """Runs function repeat times and records the fastest wall time and the highest peak memory."""
+    wall_times, peaks = [], []
+    for _ in range(repeat):
+        with PeakMemory() as memory:
+            start = time.perf_counter()
+            function()
+            wall_times.append(time.perf_counter() - start)
+        peaks.append(memory.peak)
+    result = {
+        "dataset": dataset,
+        "stage": stage,
+        "variant": variant,
+        "slices": n_slices,
+        "wall_time_s": min(wall_times),
+        "slices_per_s": n_slices / min(wall_times),
+        "peak_rss_mb": max(peaks) / 1024 ** 2,
+    }
+    results.append(result)
+    print(f"{dataset:10s} {stage:9s} {variant:18s} {result['wall_time_s']:8.3f} s {result['slices_per_s']:9.1f} slices/s "
+          f"{result['peak_rss_mb']:8.0f} MB")
+    return result
+
+
+def benchmark_dataset(results, dataset, options):
+    directory = os.path.join(options.datasets_dir, dataset)
+    dicom_files, _ = find_series_files(directory)  # Largest series in slice order, like the viewers load it
+    if not dicom_files:
+        print(f"Skipping {dataset}: no DICOM series found")
+        return
+    if options.slices:
+        dicom_files = dicom_files[:options.slices]
+    n = len(dicom_files)
+
+    try:
+        volume = load_ct_volume(dicom_files)
+    except Exception as e:  # E.g. a missing codec for JPEG 2000 compressed series
+        print(f"Skipping {dataset}: {e}")
+        return
+
+    run_stage(results, dataset, "load", "threads", n, lambda: load_ct_volume(dicom_files), options.repeat)
+    run_stage(results, dataset, "load", "sequential", n, lambda: load_ct_volume(dicom_files, workers=1), options.repeat)
+    cache_dir = tempfile.mkdtemp(prefix="benchmark_cache_")
+    try:
+        load_cached_volume(dicom_files, cache_dir=cache_dir)
+        run_stage(results, dataset, "load", "cache hit", n, lambda: load_cached_volume(dicom_files, cache_dir=cache_dir), options.repeat)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    # One pool for all filter runs, like the viewer keeps one, so the process startup is not timed
+    executor = ProcessPoolExecutor(max_workers=options.workers) if options.workers > 1 else None
+    try:
+        if executor is not None:
+            # Start the workers, after the resource tracker, so they share it instead of each starting their own
+            # (which would report the shared memory of the filter runs as leaked)
+            resource_tracker.ensure_running()
+            list(executor.map(abs, range(options.workers)))
+        for filter_type in FILTER_TYPES:
+            for mode in options.filter_modes:
+                run_stage(results, dataset, "filter", f"{filter_type} {mode}", n,
+                          lambda: filter_volume(volume, filter_type, FILTER_PARAMS, mode=mode, workers=options.workers,
+                                                executor=executor),
+                          options.repeat)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    for method in INTERPOLATION_ORDERS:
+        run_stage(results, dataset, "resample", method, n, lambda: ResamplingEngine(volume).resampled(method), options.repeat)
+
+
+def compare(results, baseline_path):
+    """Prints the change in wall time of every stage that also exists in the baseline file."""
+    with open(baseline_path, "r") as f:
+        baseline = {(r["dataset"], r["stage"], r["variant"]): r for r in json.load(f)["results"]}
+    print(f"\nComparison with {baseline_path} (speedup > 1 means faster now):")
+    for result in results:
+        old = baseline.get((result["dataset"], result["stage"], result["variant"]))
+        if old is not None:
+            speedup = old["wall_time_s"] / result["wall_time_s"]
+            memory = result["peak_rss_mb"] - old["peak_rss_mb"]
+            print(f"{result['dataset']:10s} {result['stage']:9s} {result['variant']:18s} speedup {speedup:6.2f}x "
+                  f"peak memory {memory:+8.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the DICOM load, filter and resample hot paths of the UE3 viewers")
+    parser.add_argument("--datasets", nargs="+", choices=DATASETS, default=DATASETS)
+    parser.add_argument("--datasets-dir", default=DATASETS_DIR)
+    parser.add_argument("--slices", type=int, help="Only use the first N slices of every series (for quick runs)")
+    parser.add_argument("--filter-modes", nargs="+", choices=["2d", "3d"], default=["2d", "3d"])
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes for filtering")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage, the fastest one is reported")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    options = parser.parse_args()
+
+    results = []
+    for dataset in options.datasets:
+        benchmark_dataset(results, dataset, options)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "options": vars(options),
+        },
+        "results": results,
+    }
+    with open(options.output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Results saved as {options.output}")
+
+    if options.compare:
+        compare(results, options.compare)
+
+
+if __name__ == "__main__":
+    main()
+
+# Example usage:
+# Full run over all bundled series:
+# python benchmark.py --output before.json
+#
+# Quick run after a change, compared with the earlier results:
+# python benchmark.py --datasets HeadNeck --repeat 1 --output after.json --compare before.json
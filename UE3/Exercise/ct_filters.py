@@ -0,0 +1,270 @@
+import math
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+from scipy.ndimage import gaussian_filter, median_filter, uniform_filter
+
+from dicom_volume import as_array
+
+FILTER_TYPES = ["gaussian", "median", "average"]
+FILTER_MODES = ["2d", "3d"]
+
+
+def filter_slab(slab, filter_type, params, mode="2d", output=None):
+    """
+    Applies one filter to a stack of slices.
+
+    In "2d" mode every slice is filtered on its own (a single scipy call over the in-plane axes), in "3d"
+    mode the kernel also extends across slices, smoothing along the slice axis.
+
+    Filters and their parameters (keys of params):
+        - "gaussian": Smooths with a Gaussian kernel of standard deviation "gaussian_std", truncated at
+          "gaussian_radius" voxels. Larger values smooth more.
+        - "median": Replaces each voxel by the median of its "kernel_size" neighbourhood, removes
+          salt-and-pepper noise while preserving edges.
+        - "average": Replaces each voxel by the mean of its "kernel_size" neighbourhood.
+    """
+    axes = (1, 2) if mode == "2d" else None
+    if filter_type == "gaussian":
+        return gaussian_filter(slab, sigma=params["gaussian_std"], radius=params["gaussian_radius"], axes=axes, output=output)
+    elif filter_type == "median":
+        return median_filter(slab, size=params["kernel_size"], axes=axes, output=output)
+    elif filter_type == "average":
+        return uniform_filter(slab, size=params["kernel_size"], axes=axes, output=output)
+    raise ValueError(f"Unknown filter type: {filter_type}")
+
+
+def filter_halo(filter_type, params, mode="2d"):
+    """Returns how many neighbouring slices on each side a slab needs to be filtered exactly like the whole volume."""
+    if mode == "2d":
+        return 0
+    if filter_type == "gaussian":
+        return int(params["gaussian_radius"])
+    return int(params["kernel_size"]) // 2
+
+
+def filter_volume(volume, filter_type, params, mode="2d", workers=None, executor=None, slab_size=None,
+                  first=None, output=None, cancel_event=None, on_slab_done=None):
+    """
+    Filters a whole CT volume in parallel.
+
+    The volume is split into slabs of consecutive slices. In "3d" mode every slab is extended by a halo
+    of neighbouring slices, so the stitched result is identical to filtering the whole volume at once.
+    The slabs are filtered on a process pool: the input is shared with the workers through shared memory
+    (or, for a memory-mapped cached volume, through the cache file) instead of being pickled, only the
+    filtered slabs travel back.
+
+    Parameters:
+        volume (np.ndarray): The input volume with shape (n_slices, rows, cols).
+        filter_type (str): "gaussian", "median" or "average".
+        params (dict): The filter parameters "gaussian_radius", "gaussian_std" and "kernel_size".
+        mode (str): "2d" filters each slice on its own, "3d" applies one volumetric filter.
+        workers (int): Number of worker processes. Defaults to the number of CPU cores, 1 filters in-process.
+        executor (concurrent.futures.Executor): Optional pool to reuse, e.g. one kept alive by the viewer.
+        slab_size (int): Slices per slab. Defaults to a size that gives every worker about four slabs.
+        first (int): Optional slice index, slabs closest to it are filtered first.
+        output (np.ndarray): Optional array the result is written into.
+        cancel_event (threading.Event): Optional event, once set the remaining slabs are dropped.
+        on_slab_done (callable): Optional callback on_slab_done(start, stop), called for every finished slab.
+
+    Returns:
+        np.ndarray: The filtered volume, or None if the run was cancelled.
+    """
+    if mode not in FILTER_MODES:
+        raise ValueError(f"Unknown filter mode: {mode}")
+    volume_array = as_array(volume)  # Keeps a cached volume memory-mapped, so workers can reopen its file
+    n_slices = len(volume_array)
+    if output is None:
+        output = np.empty_like(volume_array)
+    workers = workers or getattr(executor, "_max_workers", None) or os.cpu_count() or 1
+    slab_size = slab_size or max(1, math.ceil(n_slices / (4 * workers)))
+    slabs = [(start, min(start + slab_size, n_slices)) for start in range(0, n_slices, slab_size)]
+    if first is not None:
+        slabs.sort(key=lambda slab: 0 if slab[0] <= first < slab[1] else min(abs(slab[0] - first), abs(slab[1] - 1 - first)))
+
+    if workers == 1 and executor is None:
+        buffers = SlabBuffers()
+        for start, stop in slabs:
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            filter_range(volume_array, start, stop, filter_type, params, mode, output=output[start:stop], buffers=buffers)
+            if on_slab_done is not None:
+                on_slab_done(start, stop)
+        return output
+
+    source, shm = _share_array(volume_array)
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = {executor.submit(_filter_shared_slab, source, start, stop, filter_type, params, mode): (start, stop)
+                   for start, stop in slabs}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            if cancel_event is not None and cancel_event.is_set():
+                for future in pending:
+                    future.cancel()
+                return None
+            for future in done:
+                start, stop = futures[future]
+                output[start:stop] = future.result()
+                if on_slab_done is not None:
+                    on_slab_done(start, stop)
+        return output
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+
+class SlabBuffers:
+    """Reusable float32 input and output buffers for filtering slab after slab without new allocations."""
+
+    def __init__(self):
+        self._input = None
+        self._output = None
+
+    def get(self, shape):
+        """Returns input and output buffers of the given shape, views into the existing ones where they are large enough."""
+        if self._input is None or self._input.shape[0] < shape[0] or self._input.shape[1:] != shape[1:]:
+            self._input = np.empty(shape, dtype=np.float32)
+            self._output = np.empty(shape, dtype=np.float32)
+        return self._input[:shape[0]], self._output[:shape[0]]
+
+
+def filter_range(volume, start, stop, filter_type, params, mode="2d", output=None, buffers=None):
+    """
+    Filters the slices start to stop of a volume, reading as many neighbouring slices as the halo needs.
+
+    The slab is filtered in float32 in reusable buffers, and the result is rounded into output (a new array
+    of the volume's dtype if not given). The slices are read one by one, so a lazy volume only decodes
+    the slices the range needs.
+    """
+    halo = filter_halo(filter_type, params, mode)
+    low, high = max(0, start - halo), min(len(volume), stop + halo)
+    slab, filtered = (buffers or SlabBuffers()).get((high - low,) + tuple(volume.shape[1:]))
+    for index in range(low, high):
+        slab[index - low] = volume[index]
+    filter_slab(slab, filter_type, params, mode, output=filtered)
+    if output is None:
+        output = np.empty((stop - start,) + tuple(volume.shape[1:]), dtype=volume.dtype)
+    return store_as(filtered[start - low:stop - low], output)
+
+
+def store_as(values, output):
+    """Writes float values into output, rounded and clipped to the range of its dtype if that is an integer type."""
+    if output.dtype.kind in "iu":
+        info = np.iinfo(output.dtype)
+        values = np.clip(np.rint(values, out=values), info.min, info.max, out=values)
+    output[...] = values
+    return output
+
+
+def _share_array(array):
+    """Returns a picklable description of array for the worker processes and the shared memory block, if one was created."""
+    # Views into a memory map inherit its filename and offset, so only the full mapped array can be reopened by name
+    if (isinstance(array, np.memmap) and array.filename and array.flags.c_contiguous
+            and os.path.getsize(array.filename) - array.offset == array.nbytes):
+        return ("memmap", array.filename, array.offset, array.shape, array.dtype.str), None
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return ("shm", shm.name, 0, array.shape, array.dtype.str), shm
+
+
+def _attach_array(source):
+    kind, name, offset, shape, dtype = source
+    if kind == "memmap":
+        return np.memmap(name, dtype=dtype, mode="r", offset=offset, shape=shape), None
+    shm = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf), shm
+
+
+_worker_buffers = SlabBuffers()  # Per worker process, reused by every slab the process filters
+
+
+def _filter_shared_slab(source, start, stop, filter_type, params, mode):
+    volume, shm = _attach_array(source)
+    try:
+        return filter_range(volume, start, stop, filter_type, params, mode, buffers=_worker_buffers)
+    finally:
+        del volume
+        if shm is not None:
+            shm.close()
+
+
+class FilterJob:
+    """
+    Filters a volume in the background, visible slices first.
+
+    The job can be indexed like the filtered volume. A slice that the workers have not reached yet is
+    filtered synchronously on access (in "3d" mode together with its halo), so the slice on screen never
+    waits for the rest of the volume. start() runs filter_volume on a worker pool in a background thread,
+    slabs nearest to the visible slice first, and cancel() stops a job whose parameters became stale:
+    pending slabs are dropped and running workers are not waited for. If the background run fails (e.g. a
+    broken worker pool), the exception is kept in error and the job never finishes, slices are still filtered
+    on access.
+    """
+
+    def __init__(self, volume, filter_type, params, mode="2d"):
+        self.volume = volume
+        self.filter_type = filter_type
+        self.params = dict(params)  # Snapshot, the UI may change the parameters while the job runs
+        self.mode = mode
+        self.output = np.empty(volume.shape, dtype=volume.dtype)
+        self.done = np.zeros(len(volume), dtype=bool)
+        self._cancelled = threading.Event()
+        self._thread = None
+        self._buffers = SlabBuffers()
+        self.error = None  # Exception of the background run, if it failed
+
+    def __len__(self):
+        return len(self.done)
+
+    def __getitem__(self, index):
+        if not self.done[index]:
+            self._filter(index)
+        return self.output[index]
+
+    @property
+    def n_done(self):
+        return int(np.count_nonzero(self.done))
+
+    @property
+    def finished(self):
+        return bool(self.done.all())
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def start(self, executor, first=0, slab_size=4):
+        """Filters the whole volume on executor in a background thread, starting around slice first."""
+        self._thread = threading.Thread(target=self._run, daemon=True, kwargs=dict(
+            volume=self.volume, filter_type=self.filter_type, params=self.params, mode=self.mode,
+            executor=executor, slab_size=slab_size, first=first, output=self.output,
+            cancel_event=self._cancelled, on_slab_done=self._mark_done))
+        self._thread.start()
+
+    def _run(self, **kwargs):
+        try:
+            filter_volume(**kwargs)
+        except Exception as e:  # Reported by the UI through error, a background thread has nobody to raise to
+            self.error = e
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _mark_done(self, start, stop):
+        self.done[start:stop] = True
+
+    def _filter(self, index):
+        # A slice may be filtered twice if the UI requests it while a worker is on it, both write the same values
+        filter_range(self.volume, index, index + 1, self.filter_type, self.params, self.mode,
+                     output=self.output[index:index + 1], buffers=self._buffers)
+        self.done[index] = True
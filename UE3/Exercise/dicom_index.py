@@ -0,0 +1,180 @@
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pydicom
+from pydicom.errors import InvalidDicomError
+
+from dicom_volume import CACHE_DIR_NAME
+
+INDEX_FILE_NAME = "dicom_index.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    is_dicom INTEGER NOT NULL,
+    series_uid TEXT,
+    series_description TEXT,
+    modality TEXT,
+    instance_number INTEGER,
+    slice_position REAL,
+    rows INTEGER,
+    columns INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_series ON files (series_uid);
+"""
+
+
+def read_header(file_path):
+    """
+    Reads the header of a DICOM file (without its pixel data) and returns the fields the index stores.
+
+    slice_position is the ImagePositionPatient projected onto the slice normal (the cross product of the
+    ImageOrientationPatient row and column directions), which orders slices by anatomy for any orientation.
+    Returns None for files that are not DICOM files.
+    """
+    try:
+        ds = pydicom.dcmread(file_path, stop_before_pixels=True)
+    except (InvalidDicomError, OSError, EOFError):
+        return None
+    if "SeriesInstanceUID" not in ds:
+        return None
+
+    slice_position = None
+    if "ImagePositionPatient" in ds:
+        orientation = np.asarray(ds.get("ImageOrientationPatient", [1, 0, 0, 0, 1, 0]), dtype=float)
+        normal = np.cross(orientation[:3], orientation[3:])
+        slice_position = float(np.dot(np.asarray(ds.ImagePositionPatient, dtype=float), normal))
+    instance_number = ds.get("InstanceNumber")
+    return {
+        "series_uid": str(ds.SeriesInstanceUID),
+        "series_description": str(ds.get("SeriesDescription", "")),
+        "modality": str(ds.get("Modality", "")),
+        "instance_number": int(instance_number) if instance_number not in (None, "") else None,
+        "slice_position": slice_position,
+        "rows": int(ds.get("Rows", 0)),
+        "columns": int(ds.get("Columns", 0)),
+    }
+
+
+class DicomIndex:
+    """
+    Persistent index of the DICOM files below a directory, built from their headers only.
+
+    Files are grouped into series by SeriesInstanceUID and ordered by their position along the slice normal,
+    so neither file names nor extensions matter. The index is kept in a SQLite database (by default in the
+    .volume_cache folder of the directory) together with the size and modification time of every file, so a
+    rescan only reads the headers of new or modified files and drops files that were deleted.
+    """
+
+    def __init__(self, directory, db_path=None):
+        self.directory = os.path.abspath(directory)
+        if db_path is None:
+            db_path = os.path.join(self.directory, CACHE_DIR_NAME, INDEX_FILE_NAME)
+        try:
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            self.connection = sqlite3.connect(db_path)
+        except (OSError, sqlite3.OperationalError) as e:
+            print(f"Warning: Could not open DICOM index {db_path}, indexing in memory: {e}")
+            self.connection = sqlite3.connect(":memory:")
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def scan(self, workers=None, progress=None):
+        """
+        Brings the index up to date with the files on disk.
+
+        The headers of new and modified files are read on a thread pool (pydicom releases the GIL while
+        reading). progress(done, total) is called from the calling thread for every header read.
+
+        Returns:
+            int: The number of headers that were read.
+        """
+        on_disk = {}
+        for root, directories, filenames in os.walk(self.directory):
+            directories[:] = sorted(d for d in directories if d != CACHE_DIR_NAME)
+            for filename in filenames:
+                file_path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue  # Deleted while walking the directory
+                on_disk[file_path] = (stat.st_size, stat.st_mtime_ns)
+
+        indexed = {path: (size, mtime_ns) for path, size, mtime_ns in
+                   self.connection.execute("SELECT path, size, mtime_ns FROM files")}
+        removed = [(path,) for path in indexed if path not in on_disk]
+        changed = sorted(path for path, stat in on_disk.items() if indexed.get(path) != stat)
+
+        rows = []
+        if changed:
+            with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+                for done, (file_path, header) in enumerate(zip(changed, executor.map(read_header, changed)), start=1):
+                    size, mtime_ns = on_disk[file_path]
+                    header = header or {}
+                    rows.append((file_path, size, mtime_ns, bool(header), header.get("series_uid"),
+                                 header.get("series_description"), header.get("modality"), header.get("instance_number"),
+                                 header.get("slice_position"), header.get("rows"), header.get("columns")))
+                    if progress is not None:
+                        progress(done, len(changed))
+
+        with self.connection:
+            self.connection.executemany("DELETE FROM files WHERE path = ?", removed)
+            self.connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(changed)
+
+    def series(self):
+        """
+        Returns the indexed series, largest first.
+
+        Returns:
+            list of dict: One dict per series with "uid", "description", "modality" and "n_files".
+        """
+        query = """
+            SELECT series_uid, MAX(series_description), MAX(modality), COUNT(*) FROM files
+            WHERE is_dicom GROUP BY series_uid ORDER BY COUNT(*) DESC, series_uid
+        """
+        return [{"uid": uid, "description": description, "modality": modality, "n_files": n_files}
+                for uid, description, modality, n_files in self.connection.execute(query)]
+
+    def series_files(self, series_uid):
+        """
+        Returns the files of one series in slice order.
+
+        Slices are ordered from head to feet (descending position along the slice normal), the order in
+        which scanners usually number axial series. Files without a position fall back to InstanceNumber.
+        """
+        query = """
+            SELECT path FROM files WHERE is_dicom AND series_uid = ?
+            ORDER BY slice_position IS NULL, slice_position DESC, instance_number, path
+        """
+        return [path for (path,) in self.connection.execute(query, (series_uid,))]
+
+    def directories(self):
+        """Returns the directories that contain DICOM files, sorted."""
+        paths = (path for (path,) in self.connection.execute("SELECT path FROM files WHERE is_dicom"))
+        return sorted({os.path.dirname(path) for path in paths})
+
+
+def find_series_files(directory, workers=None, progress=None):
+    """
+    Indexes a directory and returns (files, series): the files of its largest series in slice order ([] if
+    there is none) and the list of all series (see DicomIndex.series), so callers can report the others.
+    """
+    with DicomIndex(directory) as index:
+        index.scan(workers=workers, progress=progress)
+        series = index.series()
+        if not series:
+            return [], series
+        return index.series_files(series[0]["uid"]), series
@@ -0,0 +1,455 @@
+import hashlib
+import json
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pydicom
+
+# Name of the folder next to a DICOM series in which its decoded volume is cached
+CACHE_DIR_NAME = ".volume_cache"
+
+
+def _decode_slice(file_path, volume, index):
+    """Decodes a single DICOM file directly into its slot of the preallocated volume."""
+    pixels = pydicom.dcmread(file_path).pixel_array
+    if pixels.shape != volume.shape[1:]:
+        raise ValueError(f"{file_path} has shape {pixels.shape}, expected {volume.shape[1:]}")
+    volume[index] = pixels
+
+
+def storage_dtype(ds, dtype):
+    """
+    Returns the dtype a volume of stored pixel values is kept in.
+
+    CT scanners mostly store 12 bits in unsigned 16-bit pixels. Those values fit into int16, which is the
+    dtype every filter result and Hounsfield conversion can share, so such series are stored as int16.
+    """
+    dtype = np.dtype(dtype)
+    if dtype == np.uint16 and int(ds.get("BitsStored", 16)) <= 15:
+        return np.dtype(np.int16)
+    return dtype
+
+
+def read_rescale(dicom_file):
+    """Returns the (RescaleSlope, RescaleIntercept) of a DICOM file, reading only its header."""
+    ds = pydicom.dcmread(dicom_file, stop_before_pixels=True)
+    return float(ds.get("RescaleSlope", 1)), float(ds.get("RescaleIntercept", 0))
+
+
+def read_spacing(dicom_files):
+    """
+    Returns the (slice, row, column) voxel spacing of a series in mm, reading only headers.
+
+    The slice spacing is the distance between the ImagePositionPatient of the first two files (it may differ
+    from SliceThickness for overlapping or gapped reconstructions), falling back to SliceThickness and 1.
+    """
+    first = pydicom.dcmread(dicom_files[0], stop_before_pixels=True)
+    row_spacing, column_spacing = (float(value) for value in first.get("PixelSpacing", [1, 1]))
+    slice_spacing = float(first.get("SliceThickness", 0) or 0)
+    if len(dicom_files) > 1 and "ImagePositionPatient" in first:
+        second = pydicom.dcmread(dicom_files[1], stop_before_pixels=True)
+        if "ImagePositionPatient" in second:
+            distance = np.linalg.norm(np.subtract(second.ImagePositionPatient, first.ImagePositionPatient, dtype=float))
+            slice_spacing = float(distance) or slice_spacing
+    return slice_spacing or 1.0, row_spacing, column_spacing
+
+
+def as_array(volume):
+    """
+    Returns a volume as an ndarray without copying it.
+
+    Unlike np.asarray this keeps memory maps (np.asarray turns them into plain views, which loses the file
+    name needed to share them with worker processes) and loads lazy volumes through the volume cache.
+    """
+    if isinstance(volume, np.ndarray):
+        return volume
+    if hasattr(volume, "materialize"):
+        return volume.materialize()
+    return np.asarray(volume)
+
+
+def load_ct_volume(dicom_files, workers=None, progress=None):
+    """
+    Loads a DICOM series into one contiguous 3D volume.
+
+    The first file is decoded to determine the slice shape and the native pixel dtype, the remaining
+    files are decoded on a thread pool straight into a preallocated (n_slices, rows, cols) array.
+    pydicom releases the GIL while reading and while the pixel data codecs run, so threads keep all
+    cores busy without the pickling overhead of a process pool.
+
+    Parameters:
+        dicom_files (list of str): Paths of the DICOM files, in slice order.
+        workers (int): Number of decoding threads. Defaults to the number of CPU cores.
+        progress (callable): Optional callback progress(done, total). It is called from the calling
+            thread (never from a worker), so it may safely update Tk widgets.
+
+    Returns:
+        np.ndarray: The CT volume with shape (n_slices, rows, cols). It holds the stored pixel values in their
+            native dtype, or in int16 if 16-bit unsigned data fits into it (see storage_dtype).
+    """
+    total = len(dicom_files)
+    if total == 0:
+        raise ValueError("No DICOM files to load")
+
+    first_ds = pydicom.dcmread(dicom_files[0])
+    first = first_ds.pixel_array
+    volume = np.empty((total,) + first.shape, dtype=storage_dtype(first_ds, first.dtype))
+    volume[0] = first
+    if progress is not None:
+        progress(1, total)
+
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_decode_slice, file_path, volume, index)
+                   for index, file_path in enumerate(dicom_files[1:], start=1)]
+        for done, future in enumerate(as_completed(futures), start=2):
+            future.result()  # Re-raises decoding errors in the calling thread
+            if progress is not None:
+                progress(done, total)
+    return volume
+
+
+def series_fingerprint(dicom_files):
+    """Returns a hash over the file names, sizes and modification times of a DICOM series."""
+    digest = hashlib.sha1()
+    for file_path in dicom_files:
+        stat = os.stat(file_path)
+        digest.update(f"{os.path.basename(file_path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()
+
+
+def load_cached_volume(dicom_files, cache_dir=None, workers=None, progress=None):
+    """
+    Loads a DICOM series through a persistent on-disk volume cache.
+
+    The decoded volume is stored as a raw .npy file next to a small JSON sidecar, both named after the
+    SeriesInstanceUID and the series fingerprint. A reload with an unchanged fingerprint memory-maps the .npy
+    file read-only, so it costs no decoding and the volume does not have to fit into RAM. Entries of the same
+    series with a different fingerprint are stale (files were added, removed or modified) and are deleted
+    when the series is reloaded, entries of other series in the same directory are kept.
+
+    Parameters:
+        dicom_files (list of str): Paths of the DICOM files, in slice order.
+        cache_dir (str): Directory for the cache files. Defaults to a .volume_cache folder next to the series.
+        workers (int): Number of decoding threads on a cache miss, see load_ct_volume.
+        progress (callable): Optional callback progress(done, total), see load_ct_volume.
+
+    Returns:
+        np.ndarray: The CT volume, a read-only memory map unless the cache could not be written.
+    """
+    cache_dir, key = _cache_location(dicom_files, cache_dir)
+    volume = _read_cache(cache_dir, key)
+    if volume is not None:
+        if progress is not None:
+            progress(len(dicom_files), len(dicom_files))
+        return volume
+
+    volume_path = os.path.join(cache_dir, f"{key}.npy")
+    meta_path = os.path.join(cache_dir, f"{key}.json")
+    volume = load_ct_volume(dicom_files, workers=workers, progress=progress)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        _remove_stale_entries(cache_dir, key)
+        # Write to temporary files first, so an interrupted write never leaves a valid looking entry behind
+        np.save(volume_path + ".tmp.npy", volume)
+        os.replace(volume_path + ".tmp.npy", volume_path)
+        meta = {"key": key, "shape": list(volume.shape), "dtype": str(volume.dtype), "n_files": len(dicom_files)}
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f, indent=4)
+        os.replace(meta_path + ".tmp", meta_path)
+    except OSError as e:
+        print(f"Warning: Could not write volume cache to {cache_dir}: {e}")
+        return volume
+    # The memory map of the new entry instead of the decoded array: worker processes can reopen it by name
+    # (see ct_filters._share_array) instead of copying the volume, and the decoded array is freed
+    cached = _read_cache(cache_dir, key)
+    return volume if cached is None else cached
+
+
+def _cache_location(dicom_files, cache_dir):
+    """
+    Returns the cache directory and the key of a series, <SeriesInstanceUID>_<fingerprint>.
+
+    Several series can share a directory and so a cache directory, the UID tells their entries apart.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(dicom_files[0])), CACHE_DIR_NAME)
+    series_uid = pydicom.dcmread(dicom_files[0], stop_before_pixels=True).get("SeriesInstanceUID", "unknown")
+    return cache_dir, f"{series_uid}_{series_fingerprint(dicom_files)}"
+
+
+def _read_cache(cache_dir, key):
+    """Returns the memory-mapped cached volume for a fingerprint, or None if there is no valid entry."""
+    volume_path = os.path.join(cache_dir, f"{key}.npy")
+    meta_path = os.path.join(cache_dir, f"{key}.json")
+    if not (os.path.exists(volume_path) and os.path.exists(meta_path)):
+        return None
+    try:
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        volume = np.load(volume_path, mmap_mode="r")
+        valid = list(volume.shape) == meta["shape"] and str(volume.dtype) == meta["dtype"]
+    except (OSError, ValueError, KeyError, TypeError):
+        valid = False  # Truncated or corrupt files, e.g. of an interrupted run before writes were atomic
+    if not valid:
+        # Removed so the series is decoded and cached again, instead of failing on every open
+        volume = None
+        for path in (volume_path, meta_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return None
+    return volume
+
+
+def _remove_stale_entries(cache_dir, key):
+    """Deletes the cache entries in cache_dir of the same series as key but with another fingerprint."""
+    series_prefix = key.rsplit("_", 1)[0] + "_"  # UIDs consist of digits and dots
+    for filename in os.listdir(cache_dir):
+        # Only volume entries, the folder also holds other caches such as the DICOM index
+        if (filename.endswith((".npy", ".json", ".tmp")) and filename.startswith(series_prefix)
+                and not filename.startswith(key)):
+            try:
+                os.remove(os.path.join(cache_dir, filename))
+            except OSError:
+                pass  # Still memory-mapped by another viewer (Windows), removed on the next reload
+
+
+def open_ct_volume(dicom_files, cache_dir=None, progress=None):
+    """
+    Opens a DICOM series for viewing with as little upfront decoding as possible.
+
+    Returns a CTVolume around the memory-mapped volume if the series is in the volume cache, otherwise
+    around a LazyVolume that decodes slices on demand. The lazy volume writes the cache as soon as the
+    whole volume is needed, so the next time the series is opened it is a cache hit.
+    """
+    slope, intercept = read_rescale(dicom_files[0])
+    cache_location = _cache_location(dicom_files, cache_dir)
+    volume = _read_cache(*cache_location)
+    if volume is None:
+        volume = LazyVolume(dicom_files, cache_dir=cache_location[0], progress=progress)
+    return CTVolume(volume, slope, intercept, spacing=read_spacing(dicom_files))
+
+
+class CTVolume:
+    """
+    A CT volume of stored pixel values with the DICOM rescale parameters attached.
+
+    The voxels stay in their compact stored dtype (usually int16), and indexing returns stored values just
+    like the underlying array does. Hounsfield units (HU = stored * slope + intercept) are computed on
+    demand for the requested slices only, so no float copy of the whole volume is ever created.
+    spacing is the (slice, row, column) voxel size in mm.
+    """
+
+    def __init__(self, data, slope=1.0, intercept=0.0, spacing=(1.0, 1.0, 1.0)):
+        self.data = data
+        self.slope = slope
+        self.intercept = intercept
+        self.spacing = tuple(spacing)
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def ndim(self):
+        return 3
+
+    @property
+    def lazy(self):
+        """True while slices are still decoded on demand."""
+        return isinstance(self.data, LazyVolume) and not self.data.loaded
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def __iter__(self):
+        return iter(self.materialize())
+
+    def __array__(self, dtype=None, copy=None):
+        volume = self.materialize()
+        return volume if dtype is None else volume.astype(dtype)
+
+    def materialize(self):
+        """Returns the stored values of the whole volume as an ndarray (a memory map if the volume is cached)."""
+        return as_array(self.data)
+
+    def prefetch(self, center):
+        if isinstance(self.data, LazyVolume):
+            self.data.prefetch(center)
+
+    def close(self):
+        """Stops the background prefetching of a lazy volume, e.g. before another series is loaded."""
+        if isinstance(self.data, LazyVolume):
+            self.data.close()
+
+    def hu(self, index=slice(None), out=None):
+        """Returns the requested slices in Hounsfield units as float32."""
+        values = np.asarray(self.data[index])
+        out = np.empty(values.shape, dtype=np.float32) if out is None else out
+        np.multiply(values, np.float32(self.slope), out=out, casting="unsafe")
+        out += np.float32(self.intercept)
+        return out
+
+    def to_stored(self, hu_values):
+        """Converts Hounsfield units (e.g. a threshold) back to stored values."""
+        return (np.asarray(hu_values) - self.intercept) / self.slope
+
+
+class LazyVolume:
+    """
+    A CT volume that decodes its slices on first access.
+
+    Integer indexing (volume[i]) decodes a single slice and keeps it in a bounded LRU cache, so the first
+    image can be shown after a single decode and memory stays bounded for arbitrarily long series. A
+    background thread prefetches the slices around the position passed to prefetch(). Anything that needs
+    the whole volume (np.asarray, iteration, slicing) loads the full series once through load_cached_volume
+    and serves all further accesses from it.
+
+    The prefetch thread only holds a weak reference to the volume, so a volume nobody uses any more is
+    freed (and its thread ends) without an explicit close(). close() ends the thread right away.
+    """
+
+    def __init__(self, dicom_files, cache_size=64, prefetch_radius=4, cache_dir=None, progress=None):
+        self.dicom_files = list(dicom_files)
+        self.cache_size = cache_size
+        self.prefetch_radius = min(prefetch_radius, (cache_size - 1) // 2)
+        self.cache_dir = cache_dir
+        self.progress = progress
+        self._slices = OrderedDict()
+        self._lock = threading.Lock()
+        self._volume = None
+        self._owner_thread = threading.current_thread()
+        self._materialize_lock = threading.Lock()  # Background tasks and the UI may need the whole volume at once
+
+        first_ds = pydicom.dcmread(self.dicom_files[0])
+        first = first_ds.pixel_array
+        self.shape = (len(self.dicom_files),) + first.shape
+        self.dtype = storage_dtype(first_ds, first.dtype)
+        self.ndim = 3
+        self._store(0, first.astype(self.dtype, copy=False))
+
+        self._prefetch_center = None
+        self._prefetch_condition = threading.Condition()
+        self._closed = threading.Event()
+        self._prefetch_thread = threading.Thread(target=_prefetch_loop, daemon=True, args=(
+            weakref.ref(self), self._prefetch_condition, self._closed))
+        self._prefetch_thread.start()
+        weakref.finalize(self, _stop_prefetching, self._prefetch_condition, self._closed)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        if self._volume is not None:
+            return self._volume[index]
+        if isinstance(index, (int, np.integer)):
+            return self._get_slice(int(index))
+        return self.materialize()[index]
+
+    def __iter__(self):
+        return iter(self.materialize())
+
+    def __array__(self, dtype=None, copy=None):
+        volume = self.materialize()
+        return volume if dtype is None else volume.astype(dtype)
+
+    @property
+    def loaded(self):
+        """True once the whole volume has been loaded."""
+        return self._volume is not None
+
+    def materialize(self):
+        """Loads the whole series (through the volume cache) and drops the per-slice LRU cache."""
+        with self._materialize_lock:
+            if self._volume is None:
+                # The progress callback usually updates the UI, so it is only called from the thread that opened the volume
+                progress = self.progress if threading.current_thread() is self._owner_thread else None
+                self._volume = load_cached_volume(self.dicom_files, cache_dir=self.cache_dir, progress=progress)
+                with self._lock:
+                    self._slices.clear()
+        return self._volume
+
+    def close(self):
+        """Stops the prefetch thread and drops the decoded slices (a loaded volume stays usable)."""
+        _stop_prefetching(self._prefetch_condition, self._closed)
+        with self._lock:
+            self._slices.clear()
+
+    def prefetch(self, center):
+        """Asks the background thread to decode the slices on either side of center."""
+        if self._volume is not None or self._closed.is_set():
+            return
+        with self._prefetch_condition:
+            self._prefetch_center = center
+            self._prefetch_condition.notify()
+
+    def _get_slice(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Slice index {index} out of range for {len(self)} slices")
+        with self._lock:
+            if index in self._slices:
+                self._slices.move_to_end(index)
+                return self._slices[index]
+        pixels = pydicom.dcmread(self.dicom_files[index]).pixel_array.astype(self.dtype, copy=False)
+        self._store(index, pixels)
+        return pixels
+
+    def _store(self, index, pixels):
+        with self._lock:
+            self._slices[index] = pixels
+            self._slices.move_to_end(index)
+            while len(self._slices) > self.cache_size:
+                self._slices.popitem(last=False)
+
+    def _prefetch_slices(self, center):
+        # Decode outwards from the current position, restart as soon as the position changes
+        for offset in range(1, self.prefetch_radius + 1):
+            if self._prefetch_center is not None or self._volume is not None or self._closed.is_set():
+                break
+            for index in (center + offset, center - offset):
+                if 0 <= index < len(self):
+                    with self._lock:
+                        cached = index in self._slices
+                    if not cached:
+                        self._get_slice(index)
+
+
+def _stop_prefetching(condition, closed):
+    with condition:
+        closed.set()
+        condition.notify()
+
+
+def _prefetch_loop(volume_ref, condition, closed):
+    """Prefetch thread of a LazyVolume, holds the volume only while decoding and ends once it is closed or freed."""
+    while True:
+        with condition:
+            while not closed.is_set():
+                volume = volume_ref()
+                if volume is None:
+                    return
+                center = volume._prefetch_center
+                volume._prefetch_center = None
+                if center is not None:
+                    break
+                del volume  # Not kept alive while waiting
+                condition.wait()
+            else:
+                return
+        volume._prefetch_slices(center)
+        del volume
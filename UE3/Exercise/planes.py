@@ -0,0 +1,58 @@
+from dicom_volume import as_array
+
+PLANES = ["axial", "coronal", "sagittal"]
+
+# Volume axis that is indexed to get a slice of each plane, the volume is stored as (slices, rows, columns)
+PLANE_AXES = {"axial": 0, "coronal": 1, "sagittal": 2}
+
+
+def plane_length(volume, plane):
+    """Returns the number of slices of a volume in the given plane."""
+    return volume.shape[PLANE_AXES[plane]]
+
+
+def plane_slice(volume, plane, index):
+    """
+    Returns slice index of a volume in the given plane.
+
+    Axial slices are indexed directly (so lazy volumes decode a single slice), coronal and sagittal slices
+    are strided views into the whole volume: volume[:, index, :] and volume[:, :, index]. Switching planes
+    therefore never copies or re-stacks the volume.
+    """
+    if plane == "axial":
+        return volume[index]
+    volume = as_array(volume)
+    if plane == "coronal":
+        return volume[:, index, :]
+    if plane == "sagittal":
+        return volume[:, :, index]
+    raise ValueError(f"Unknown plane: {plane}")
+
+
+def plane_voxel(plane, index, row, col):
+    """Returns the (slice, row, col) volume index of pixel (row, col) of slice index in the given plane."""
+    if plane == "axial":
+        return index, row, col
+    if plane == "coronal":
+        return row, index, col
+    if plane == "sagittal":
+        return row, col, index
+    raise ValueError(f"Unknown plane: {plane}")
+
+
+def plane_aspect(spacing, plane):
+    """
+    Returns the aspect ratio (height / width of a pixel) to display a slice of the given plane with.
+
+    spacing is the (slice, row, column) spacing of the volume in mm. Slices are usually thicker than the
+    in-plane pixels, so coronal and sagittal images are stretched at display time (imshow's aspect) instead
+    of being resampled.
+    """
+    slice_spacing, row_spacing, column_spacing = spacing
+    if plane == "axial":
+        return row_spacing / column_spacing
+    if plane == "coronal":
+        return slice_spacing / column_spacing
+    if plane == "sagittal":
+        return slice_spacing / row_spacing
+    raise ValueError(f"Unknown plane: {plane}")
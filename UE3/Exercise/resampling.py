@@ -0,0 +1,158 @@
+import threading
+from functools import lru_cache
+
+import numpy as np
+from scipy.ndimage import zoom
+
+from ct_filters import store_as
+from result_cache import ResultCache
+
+INTERPOLATION_ORDERS = {"nearest": 0, "bilinear": 1, "bicubic": 3}
+
+
+def interpolation_order(method):
+    """Returns the spline order of an interpolation method, defaulting to bicubic."""
+    return INTERPOLATION_ORDERS.get(method, 3)
+
+
+# Spline orders resampled with matrix products, the others per slice with scipy.ndimage.zoom (see zoom_slices)
+MATRIX_ORDERS = {3}
+
+
+@lru_cache(maxsize=32)
+def zoom_matrix(n_in, factor, order):
+    """
+    Returns the (n_in, n_out) matrix that applies scipy.ndimage.zoom with the given factor and order to a 1D signal.
+
+    zoom is linear in its input, so zooming the rows of an identity matrix yields the responses to all unit
+    impulses. The spline prefilter and the output size rounding of zoom are therefore reproduced exactly.
+    The matrix stays float64: the prefilter responses decay to values that are subnormal in float32, which
+    makes float32 matrix products several times slower, and float64 rounds like scipy does.
+    """
+    return zoom(np.eye(n_in), (1, factor), order=order)
+
+
+def zoom_slices(volume, factor, order, slab_size=8, output=None):
+    """
+    Zooms every slice of a volume in-plane by factor, like calling scipy.ndimage.zoom on each slice.
+
+    Spline interpolation is separable, so for bicubic interpolation the whole stack is resampled with one
+    matrix product per in-plane axis instead of a 2D interpolation with a spline prefilter per slice. The
+    work runs in BLAS and is processed in slabs of slab_size slices to bound the float64 intermediates.
+    Nearest and bilinear interpolation have no prefilter and scipy is as fast or faster for them, so they
+    are zoomed slice by slice with scipy. Integer results are rounded and clipped to the range of the input
+    dtype (scipy would wrap around where bicubic interpolation overshoots).
+    """
+    volume = np.asarray(volume)
+    n_slices, rows, cols = volume.shape
+    if order not in MATRIX_ORDERS:
+        if output is None:
+            output = np.empty((n_slices, int(round(rows * factor)), int(round(cols * factor))), dtype=volume.dtype)
+        for index in range(n_slices):
+            zoom(volume[index], factor, order=order, output=output[index])
+        return output
+
+    row_matrix = zoom_matrix(rows, factor, order).T  # (rows_out, rows)
+    col_matrix = zoom_matrix(cols, factor, order)  # (cols, cols_out)
+    if output is None:
+        output = np.empty((n_slices, row_matrix.shape[0], col_matrix.shape[1]), dtype=volume.dtype)
+
+    # float64 buffers for one slab, reused for every slab (the last one may be shorter)
+    slab_size = min(slab_size, n_slices)
+    slab_buffer = np.empty((slab_size, rows, cols))
+    row_buffer = np.empty((slab_size, row_matrix.shape[0], cols))
+    result_buffer = np.empty((slab_size,) + output.shape[1:])
+    for start in range(0, n_slices, slab_size):
+        stop = min(start + slab_size, n_slices)
+        count = stop - start
+        slab_buffer[:count] = volume[start:stop]
+        np.matmul(row_matrix, slab_buffer[:count], out=row_buffer[:count])
+        np.matmul(row_buffer[:count], col_matrix, out=result_buffer[:count])
+        store_as(result_buffer[:count], output[start:stop])
+    return output
+
+
+def resampled_shape(shape, zoom_factor):
+    """
+    Returns the shape of a (n_slices, rows, cols) volume after zooming its slices by 1 / zoom_factor and back.
+
+    scipy.ndimage.zoom rounds the output size, so the result can differ from the input, e.g. 512 -> 171 -> 513
+    for a zoom factor of 3.
+    """
+    n_slices, rows, cols = shape
+    rows, cols = (int(round(int(round(n / zoom_factor)) * zoom_factor)) for n in (rows, cols))
+    return n_slices, rows, cols
+
+
+class ResamplingEngine:
+    """
+    Resamples a CT volume down by zoom_factor and back up, caching every intermediate result.
+
+    The downsampled level and the resampled volume are cached per interpolation order, so switching the
+    interpolation method only computes what is missing and switching back is free. A resampled volume larger
+    than the cache budget is never kept (see fits_cache), its slices are then resampled on access from the
+    much smaller downsampled level.
+    """
+
+    def __init__(self, volume, zoom_factor=4, cache=None):
+        self.volume = volume
+        self.zoom_factor = zoom_factor
+        self.cache = cache if cache is not None else ResultCache()
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def downsampled(self, method):
+        """Returns the volume zoomed by 1 / zoom_factor."""
+        order = interpolation_order(method)
+        return self._cached(("down", order), lambda: zoom_slices(self.volume, 1 / self.zoom_factor, order))
+
+    def resampled(self, method):
+        """Returns the volume zoomed down and back up, i.e. scipy.ndimage.zoom by 1 / zoom_factor and back per slice."""
+        order = interpolation_order(method)
+        return self._cached(("up", order), lambda: zoom_slices(self.downsampled(method), self.zoom_factor, order))
+
+    def resampled_slice(self, index, method):
+        """Returns a single resampled slice, from the cached volumes if they exist."""
+        order = interpolation_order(method)
+        # A single get per key, a check before the get could race with an eviction by another thread
+        up = self.cache.get(("up", order))
+        if up is not None:
+            return up[index]
+        down = self.cache.get(("down", order))
+        if down is not None:
+            return zoom_slices(down[index][np.newaxis], self.zoom_factor, order)[0]
+        low = zoom_slices(np.asarray(self.volume[index])[np.newaxis], 1 / self.zoom_factor, order)
+        return zoom_slices(low, self.zoom_factor, order)[0]
+
+    def is_resampled(self, method):
+        return ("up", interpolation_order(method)) in self.cache
+
+    def fits_cache(self):
+        """True if a resampled volume fits into the cache budget, otherwise resampled() results are not kept."""
+        shape = resampled_shape(self.volume.shape, self.zoom_factor)
+        return int(np.prod(shape)) * np.dtype(self.volume.dtype).itemsize <= self.cache.max_bytes
+
+    def _cached(self, key, compute):
+        # One lock per key, so a background computation and a UI request never compute the same level twice
+        with self._locks_lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            result = self.cache.get(key)
+            if result is None:
+                result = compute()
+                self.cache.put(key, result)
+            return result
+
+
+class ResampledSlices:
+    """Indexable stand-in for a resampled volume that is still being computed, resamples slices on access."""
+
+    def __init__(self, engine, method):
+        self.engine = engine
+        self.method = method
+
+    def __len__(self):
+        return len(self.engine.volume)
+
+    def __getitem__(self, index):
+        return self.engine.resampled_slice(index, self.method)
@@ -0,0 +1,60 @@
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    LRU cache for computed volumes with a memory budget.
+
+    Entries are evicted least recently used first as soon as the summed nbytes of all cached arrays exceed
+    max_bytes. Arrays larger than the whole budget are not cached at all. The hit and miss counters can be
+    shown in the UI to check how much work the cache saves.
+    """
+
+    def __init__(self, max_bytes=1024 ** 3):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """Returns the cached result for key (and counts a hit) or None (and counts a miss)."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, result):
+        """Stores result under key and evicts the least recently used entries until the budget is met."""
+        size = result.nbytes
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key).nbytes
+            if size > self.max_bytes:
+                return
+            self._entries[key] = result
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        """Drops all entries, e.g. when a different volume is loaded. The counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """Returns a short human readable summary of the cache state."""
+        return f"{self.hits} hits, {self.misses} misses, {len(self._entries)} cached ({self.nbytes / 1024 ** 2:.0f} MB)"
@@ -0,0 +1,198 @@
+import threading
+
+import numpy as np
+from scipy.ndimage import generate_binary_structure, label
+
+from dicom_volume import as_array
+
+# Voxel neighbourhoods by number of neighbours: faces (6), faces and edges (18), faces, edges and corners (26)
+NEIGHBORHOODS = {6: 1, 18: 2, 26: 3}
+
+
+def auto_threshold_interval(seed_value, value_range, interval_percent):
+    """
+    Returns the (lower, upper) threshold interval centred on the value of a seed voxel.
+
+    Like the automatic threshold interval of the MeVisLab RegionGrowing module, the interval spans
+    interval_percent of the volume's value range on either side of the seed value.
+    """
+    half_width = (value_range[1] - value_range[0]) * interval_percent / 100
+    return seed_value - half_width, seed_value + half_width
+
+
+def region_grow(volume, seeds, lower, upper, connectivity=6):
+    """
+    Grows a region from seed voxels through all connected voxels with lower <= value <= upper.
+
+    Instead of visiting voxels one by one from a queue, the intensity mask is labelled into connected
+    components in one pass (scipy.ndimage.label), and the region is the union of the components that
+    contain a seed. See RegionGrower for how the labelled part of the volume is kept small.
+
+    Parameters:
+        volume (np.ndarray): The CT volume with shape (n_slices, rows, cols).
+        seeds (list of tuple): Seed voxels as (slice, row, col) indices.
+        lower (float): Lowest value included in the region.
+        upper (float): Highest value included in the region.
+        connectivity (int): Voxel neighbourhood, 6, 18 or 26.
+
+    Returns:
+        np.ndarray: Boolean mask of the region with the shape of the volume.
+    """
+    return RegionGrower(volume, connectivity).grow(seeds, lower, upper)
+
+
+class RegionGrower:
+    """
+    Seeded 3D region growing on one volume, for interactive use.
+
+    Labelling the whole volume costs the same for a thin vessel as for the whole body, so the mask is first
+    labelled only in a box around the seeds. While the region touches a face of the box (and could continue
+    beyond it) the box is doubled towards that face, which stops as soon as the region is enclosed. Once the
+    box would cover most of the volume the whole volume is labelled, and those labels are kept, so adding
+    seeds to a large region with unchanged thresholds only selects components.
+    """
+
+    def __init__(self, volume, connectivity=6, margin=16):
+        if connectivity not in NEIGHBORHOODS:
+            raise ValueError(f"Unknown connectivity: {connectivity}, expected one of {list(NEIGHBORHOODS)}")
+        self.volume = as_array(volume)
+        self.structure = generate_binary_structure(3, NEIGHBORHOODS[connectivity])
+        self.margin = margin  # Voxels around the seeds in the first box
+        self._labels = None
+        self._labels_key = None
+        self._value_range = None
+        self._lock = threading.Lock()  # The viewer grows in a background thread
+
+    @property
+    def value_range(self):
+        """The (min, max) of the volume, computed on first use."""
+        if self._value_range is None:
+            self._value_range = (float(self.volume.min()), float(self.volume.max()))
+        return self._value_range
+
+    def labels(self, lower, upper):
+        """Returns the connected component labels of all voxels within [lower, upper] (0 outside)."""
+        with self._lock:
+            if self._labels_key != (lower, upper):
+                self._labels, self._labels_key = None, None  # Free the previous labels before allocating the new ones
+                self._labels = self._label(self.volume, lower, upper)
+                self._labels_key = (lower, upper)
+            return self._labels
+
+    def grow(self, seeds, lower, upper):
+        """Returns the mask of the region grown from seeds, see region_grow."""
+        seeds = [tuple(int(i) for i in seed) for seed in seeds]
+        with self._lock:
+            # One snapshot, labels() may replace both in another thread
+            labels_key, labels = self._labels_key, self._labels
+        if labels_key == (lower, upper):
+            return self._select(labels, seeds)
+
+        seed_array = np.array(seeds)
+        low = np.maximum(seed_array.min(axis=0) - self.margin, 0)
+        high = np.minimum(seed_array.max(axis=0) + self.margin + 1, self.volume.shape)
+        while np.prod(high - low) <= np.prod(self.volume.shape) // 2:
+            box = tuple(slice(a, b) for a, b in zip(low, high))
+            region = self._select(self._label(self.volume[box], lower, upper), [tuple(np.subtract(seed, low)) for seed in seeds])
+            grown_low, grown_high = low.copy(), high.copy()
+            for axis in range(3):
+                size = high[axis] - low[axis]
+                if low[axis] > 0 and np.take(region, 0, axis=axis).any():
+                    grown_low[axis] = max(low[axis] - size, 0)
+                if high[axis] < self.volume.shape[axis] and np.take(region, -1, axis=axis).any():
+                    grown_high[axis] = min(high[axis] + size, self.volume.shape[axis])
+            if (grown_low == low).all() and (grown_high == high).all():
+                # The region does not reach any inner face of the box, so it is complete
+                mask = np.zeros(self.volume.shape, dtype=bool)
+                mask[box] = region
+                return mask
+            low, high = grown_low, grown_high
+        return self._select(self.labels(lower, upper), seeds)
+
+    def grow_from_seed(self, seeds, interval_percent):
+        """
+        Grows from seeds with an automatic threshold interval around the value of the first seed.
+
+        Returns:
+            tuple: (mask, lower, upper)
+        """
+        lower, upper = auto_threshold_interval(float(self.volume[tuple(seeds[0])]), self.value_range, interval_percent)
+        return self.grow(seeds, lower, upper), lower, upper
+
+    def _label(self, values, lower, upper):
+        labels, _ = label((values >= lower) & (values <= upper), structure=self.structure)
+        return labels
+
+    @staticmethod
+    def _select(labels, seeds):
+        """Returns the mask of the components that contain a seed."""
+        components = {labels[seed] for seed in seeds} - {0}  # Seeds outside the interval grow nothing
+        if not components:
+            return np.zeros(labels.shape, dtype=bool)
+        if len(components) == 1:
+            return labels == components.pop()
+        return np.isin(labels, list(components))
+
+
+def threshold_mask(values, lower, upper):
+    """Returns the mask of lower <= values <= upper, e.g. for the slice on screen."""
+    values = np.asarray(values)
+    return (values >= lower) & (values <= upper)
+
+
+class ThresholdIndex:
+    """
+    Intensity index of an integer volume for interactive thresholding.
+
+    Built once with two passes over the volume: a cumulative histogram, which gives the number of voxels
+    within any threshold interval in O(1), and the flat voxel indices sorted by value (a counting sort), which
+    gives the full mask of an interval by touching only the voxels inside it. The sort is done slab by slab,
+    so apart from the index itself (4 bytes per voxel) only slab-sized temporaries are allocated.
+    """
+
+    def __init__(self, volume, slab_size=16):
+        volume = as_array(volume)
+        if volume.dtype.kind not in "iu":
+            raise ValueError(f"ThresholdIndex needs an integer volume, got {volume.dtype}")
+        self.shape = volume.shape
+        self.offset = int(volume.min())
+        self.n_bins = int(volume.max()) - self.offset + 1
+        slabs = range(0, len(volume), slab_size)
+
+        slab_histograms = np.array([np.bincount(self._bins(volume[start:start + slab_size]), minlength=self.n_bins)
+                                    for start in slabs])
+        self.cumulative = np.concatenate(([0], np.cumsum(slab_histograms.sum(axis=0))))  # Voxels in the bins below
+
+        # Counting sort: every slab appends its voxels, in index order, behind those of earlier slabs in each bin
+        self.order = np.empty(volume.size, dtype=np.uint32 if volume.size < 2 ** 32 else np.int64)
+        write_position = self.cumulative[:-1].copy()
+        for start, counts in zip(slabs, slab_histograms):
+            slab_order = np.argsort(volume[start:start + slab_size].ravel(), kind="stable")  # Radix sort for 16-bit types
+            slab_order += start * volume[0].size
+            read_position = 0
+            for index in np.flatnonzero(counts):
+                count = counts[index]
+                self.order[write_position[index]:write_position[index] + count] = slab_order[read_position:read_position + count]
+                read_position += count
+            write_position += counts
+
+    def count(self, lower, upper):
+        """Returns the number of voxels with lower <= value <= upper."""
+        low, high = self._range(lower, upper)
+        return int(self.cumulative[high] - self.cumulative[low])
+
+    def mask(self, lower, upper):
+        """Returns the full 3D mask of lower <= value <= upper."""
+        low, high = self._range(lower, upper)
+        mask = np.zeros(self.shape, dtype=bool)
+        mask.reshape(-1)[self.order[self.cumulative[low]:self.cumulative[high]]] = True
+        return mask
+
+    def _bins(self, values):
+        return values.astype(np.int64).ravel() - self.offset
+
+    def _range(self, lower, upper):
+        """Returns the bins [low, high) of the values within [lower, upper]."""
+        low = min(max(int(np.ceil(lower)) - self.offset, 0), self.n_bins)
+        high = min(max(int(np.floor(upper)) - self.offset + 1, low), self.n_bins)
+        return low, high
@@ -0,0 +1,128 @@
+import time
+
+import numpy as np
+
+
+class SliceRenderer:
+    """
+    Draws CT slices into a matplotlib axes fast enough for scrubbing.
+
+    Instead of clearing the axes and creating a new image for every slice, one persistent AxesImage is
+    updated with set_data and only the axes region is blitted onto the canvas. Slices are mapped to 8-bit
+    through a precomputed window/level lookup table, so no per-frame normalization happens in matplotlib.
+    The mean frame time is tracked so a readout can show when scrubbing gets slower.
+    """
+
+    def __init__(self, canvas, ax, cmap="gray", overlay_color=(255, 0, 0), overlay_alpha=0.4):
+        self.canvas = canvas
+        self.ax = ax
+        self.cmap = cmap
+        self.overlay_color = np.asarray(overlay_color, dtype=np.float32)
+        self.overlay_alpha = overlay_alpha
+        self.image = None
+        self.aspect = None
+        self.background = None
+        self.window = None
+        self.grow_window = False  # Widen the window to every displayed slice that exceeds it
+        self.lut = None
+        self.lut_dtype = None
+        self.frame_time = None  # Exponential moving average in seconds
+        canvas.mpl_connect("draw_event", self._on_draw)
+
+    def set_window(self, low, high, dtype):
+        """Sets the intensity window and precomputes the lookup table for slices of the given dtype."""
+        self.window = (float(low), float(high))
+        dtype = np.dtype(dtype)
+        if dtype.kind in "iu" and dtype.itemsize <= 2:
+            # Every possible stored value gets its 8-bit gray value, indexed by the unsigned bit pattern
+            values = np.arange(2 ** (8 * dtype.itemsize), dtype=np.uint32 if dtype.itemsize == 2 else np.uint16)
+            values = values.astype(dtype.str.replace("i", "u")).view(dtype).astype(np.float32)
+            self.lut = self._scale(values)
+            self.lut_dtype = dtype
+        else:
+            self.lut = None
+            self.lut_dtype = None
+
+    def set_window_from_volume(self, volume, n_samples=16, grow=False):
+        """
+        Sets the window to the intensity range of a few evenly spaced slices of the volume.
+
+        With grow the window is widened whenever a displayed slice has values outside it. This is meant for
+        few samples (e.g. only the first slice of a lazy volume), whose range is usually too narrow, so no
+        displayed slice is ever clipped.
+        """
+        step = max(1, len(volume) // n_samples)
+        samples = [np.asarray(volume[index]) for index in range(0, len(volume), step)]
+        self.set_window(min(s.min() for s in samples), max(s.max() for s in samples), samples[0].dtype)
+        self.grow_window = grow
+
+    def reset(self):
+        """Forgets the current image, e.g. after the axes were cleared or a new series was loaded."""
+        self.image = None
+        self.background = None
+
+    def show(self, slice, aspect=1.0, mask=None):
+        """
+        Displays a slice, blitting it if the image layout did not change.
+
+        aspect is the height / width of a pixel, so anisotropic voxels are corrected when the image is drawn
+        (e.g. the slice spacing in coronal and sagittal views) without resampling the slice. An optional
+        boolean mask of the same shape (e.g. a segmentation) is blended over the slice in overlay_color.
+        """
+        start = time.perf_counter()
+        gray = self.to_uint8(slice)
+        if mask is not None:
+            gray = self.blend(gray, mask)
+        if self.image is None or self.image.get_array().shape != gray.shape or self.aspect != aspect:
+            # Full redraw: sets up the persistent image, the draw event grabs the background for blitting
+            self.ax.clear()
+            self.image = self.ax.imshow(gray, cmap=self.cmap, vmin=0, vmax=255, aspect=aspect, animated=True)
+            self.aspect = aspect
+            self.canvas.draw()
+        else:
+            self.image.set_data(gray)
+            if self.background is None:
+                self.canvas.draw()
+            else:
+                self.canvas.restore_region(self.background)
+                self.ax.draw_artist(self.image)
+                self.canvas.blit(self.ax.bbox)
+        elapsed = time.perf_counter() - start
+        self.frame_time = elapsed if self.frame_time is None else 0.9 * self.frame_time + 0.1 * elapsed
+
+    def to_uint8(self, slice):
+        """Maps a slice to 8-bit gray values through the window."""
+        slice = np.asarray(slice)
+        if self.window is None:
+            self.set_window(slice.min(), slice.max(), slice.dtype)
+        elif self.grow_window and slice.size:
+            low, high = slice.min(), slice.max()
+            if low < self.window[0] or high > self.window[1]:
+                self.set_window(min(low, self.window[0]), max(high, self.window[1]), slice.dtype)
+        if slice.dtype != self.lut_dtype and slice.dtype.kind in "iu" and slice.dtype.itemsize <= 2:
+            self.set_window(*self.window, slice.dtype)
+        if self.lut is not None and slice.dtype == self.lut_dtype:
+            return self.lut[slice.view(slice.dtype.str.replace("i", "u"))]
+        return self._scale(slice.astype(np.float32))
+
+    def blend(self, gray, mask):
+        """Returns an RGB image of an 8-bit slice with the masked pixels tinted in overlay_color."""
+        rgb = np.repeat(gray[..., np.newaxis], 3, axis=2)
+        masked = rgb[mask].astype(np.float32)
+        rgb[mask] = (1 - self.overlay_alpha) * masked + self.overlay_alpha * self.overlay_color
+        return rgb
+
+    def frame_time_text(self):
+        if self.frame_time is None:
+            return ""
+        return f"Frame time: {1000 * self.frame_time:.1f} ms ({1 / max(self.frame_time, 1e-6):.0f} fps)"
+
+    def _scale(self, values):
+        low, high = self.window
+        scaled = (values - low) * (255 / max(high - low, 1e-6))
+        return np.clip(scaled, 0, 255, out=scaled).astype(np.uint8)
+
+    def _on_draw(self, event):
+        if self.image is not None:
+            self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+            self.ax.draw_artist(self.image)
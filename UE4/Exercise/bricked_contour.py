@@ -0,0 +1,207 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pyvista as pv
+from scipy.ndimage import zoom
+
+
+def brick_ranges(n_points, n_bricks):
+    """
+    Splits n_points grid points along one axis into n_bricks ranges [start, stop).
+
+    Neighbouring ranges overlap by one point, so every cell (the space between two grid points) belongs to
+    exactly one brick and the bricks share the points of their common face.
+    """
+    n_bricks = max(1, min(n_bricks, n_points - 1))
+    bounds = np.linspace(0, n_points - 1, n_bricks + 1).round().astype(int)
+    return [(int(start), int(stop) + 1) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def split_bricks(volume, bricks_per_axis):
+    """
+    Returns the overlapping bricks of an ImageData as (grid ranges, origin) pairs, the grid ranges as one
+    (start, stop) pair per axis, and the coordinates of the seams between neighbouring bricks as one list per axis.
+    """
+    origin, spacing = np.asarray(volume.origin), np.asarray(volume.spacing)
+    ranges = [brick_ranges(volume.dimensions[axis], bricks_per_axis[axis]) for axis in range(3)]
+    bricks = []
+    for x_range in ranges[0]:
+        for y_range in ranges[1]:
+            for z_range in ranges[2]:
+                start = (x_range[0], y_range[0], z_range[0])
+                bricks.append(((x_range, y_range, z_range), tuple(origin + spacing * start)))
+    seams = [[origin[axis] + spacing[axis] * start for start, _ in ranges[axis][1:]] for axis in range(3)]
+    return bricks, seams
+
+
+def weld_seams(points, triangles, seams, tolerance):
+    """
+    Merges the duplicate vertices that two bricks produce on their common face.
+
+    Only vertices on a seam plane can be duplicates, so only those are compared (after rounding them to a
+    grid of tolerance), which is much cheaper than clean() over the whole mesh. Returns the welded points and
+    the triangles (an (n, 3) array of point ids) renumbered to them.
+    """
+    on_seam = np.zeros(len(points), dtype=bool)
+    for axis, coordinates in enumerate(seams):
+        for coordinate in coordinates:
+            on_seam |= np.abs(points[:, axis] - coordinate) <= tolerance
+    candidates = np.flatnonzero(on_seam)
+
+    # Every seam vertex is replaced by the first seam vertex at the same (rounded) position
+    representative = np.arange(len(points))
+    if len(candidates):
+        keys = np.round(points[candidates] / tolerance).astype(np.int64)
+        _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        representative[candidates] = candidates[first[inverse.ravel()]]
+
+    keep = representative == np.arange(len(points))
+    new_ids = np.cumsum(keep) - 1
+    return points[keep], new_ids[representative[triangles]]
+
+
+def _share_scalars(volume):
+    """Copies the active scalars of a volume into shared memory, returns a picklable description and the block."""
+    scalars = np.asarray(volume.active_scalars)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, scalars.nbytes))
+    np.ndarray(scalars.shape, dtype=scalars.dtype, buffer=shm.buf)[...] = scalars
+    return (shm.name, tuple(volume.dimensions), scalars.dtype.str), shm
+
+
+def _contour_brick(source, ranges, origin, spacing, isovalue, method):
+    """
+    Contours one brick of the shared scalars in a worker process, returns the surface as plain arrays (cheap to pickle).
+
+    Only the grid ranges of the brick are sent to the worker, it reads the brick from the shared memory block.
+    """
+    name, dimensions, dtype = source
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        # The point scalars of ImageData are ordered x fastest, so the Fortran order reshape indexes them [x, y, z]
+        scalars = np.ndarray(int(np.prod(dimensions)), dtype=dtype, buffer=shm.buf).reshape(dimensions, order="F")
+        (x0, x1), (y0, y1), (z0, z1) = ranges
+        brick = pv.ImageData(dimensions=(x1 - x0, y1 - y0, z1 - z0), spacing=spacing, origin=origin)
+        brick.point_data["scalars"] = scalars[x0:x1, y0:y1, z0:z1].ravel(order="F")
+        del scalars
+        surface = brick.contour([isovalue], scalars="scalars", method=method)
+        return np.asarray(surface.points), np.asarray(surface.faces)
+    finally:
+        shm.close()
+
+
+def contour_bricked(volume, isovalue, method="marching_cubes", workers=None, bricks_per_axis=None, executor=None):
+    """
+    Extracts an isosurface like volume.contour([isovalue], method=method), contouring bricks in parallel.
+
+    The volume is split into bricks that overlap by one layer of grid points, the bricks are contoured on a
+    process pool, and the pieces are merged into one mesh. The scalars are copied once into shared memory,
+    the workers only receive the grid ranges of their bricks. Vertices on the faces shared by two bricks are
+    produced by both of them (from the same edge and the same scalars), weld_seams merges these duplicates so
+    the merged surface is as watertight as the single-call surface.
+
+    The pool, the copy and the weld cost more than they save on one or two cores: on a single core this runs
+    at about 0.6-0.7x the speed of volume.contour. Use it only for large volumes on machines with several
+    cores (MeshCache.contour with method="bricked" is the opt-in for the marching cubes scripts).
+
+    Parameters:
+        volume (pv.ImageData): The volume to contour.
+        isovalue (float): The isovalue.
+        method (str): The contour method of pyvista ("marching_cubes", "flying_edges", "contour").
+        workers (int): Number of worker processes. Defaults to the number of CPU cores.
+        bricks_per_axis (tuple): Bricks along x, y and z. Defaults to about two bricks per worker, split along z.
+        executor (concurrent.futures.Executor): Optional pool to reuse.
+
+    Returns:
+        pv.PolyData: The welded isosurface.
+    """
+    workers = workers or getattr(executor, "_max_workers", None) or os.cpu_count() or 1
+    bricks_per_axis = bricks_per_axis or (1, 1, 2 * workers)
+    bricks, seams = split_bricks(volume, bricks_per_axis)
+
+    source, shm = _share_scalars(volume)
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        pieces = list(executor.map(_contour_brick, [source] * len(bricks), *zip(*bricks),
+                                   [volume.spacing] * len(bricks), [isovalue] * len(bricks), [method] * len(bricks)))
+    finally:
+        if own_executor:
+            executor.shutdown()
+        shm.close()
+        shm.unlink()
+
+    # Concatenate the pieces, shifting the point ids of every piece by the points of the earlier pieces
+    points = np.concatenate([piece_points for piece_points, _ in pieces])
+    triangles = []
+    offset = 0
+    for piece_points, piece_faces in pieces:
+        triangles.append(piece_faces.reshape(-1, 4)[:, 1:] + offset)  # Marching cubes only produces triangles: [3, a, b, c]
+        offset += len(piece_points)
+    triangles = np.concatenate(triangles)
+    if len(triangles) == 0:
+        return pv.PolyData()
+
+    # Brick origins are computed separately from the global origin, so shared vertices may differ in the last bits
+    points, triangles = weld_seams(points, triangles, seams, tolerance=1e-4 * min(volume.spacing))
+    faces = np.column_stack((np.full(len(triangles), 3, dtype=triangles.dtype), triangles))
+    return pv.PolyData(points, faces.ravel())
+
+
+def benchmark(volume, isovalue, method, workers, repeat):
+    """Times the single contour call against contour_bricked and prints the speedup and the mesh statistics."""
+    def fastest(function):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            times.append(time.perf_counter() - start)
+        return min(times), result
+
+    single_time, single = fastest(lambda: volume.contour([isovalue], method=method))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        contour_bricked(volume, isovalue, method, executor=executor)  # Warm up the worker processes
+        bricked_time, bricked = fastest(lambda: contour_bricked(volume, isovalue, method, executor=executor))
+
+    print(f"Volume {volume.dimensions} ({volume.n_points / 1e6:.1f} M points), isovalue {isovalue}, {workers} workers")
+    for name, elapsed, mesh in (("single contour", single_time, single), ("bricked", bricked_time, bricked)):
+        open_edges = mesh.extract_feature_edges(boundary_edges=True, feature_edges=False, manifold_edges=False,
+                                                non_manifold_edges=False).n_cells
+        print(f"{name:15s} {elapsed:8.3f} s  {mesh.n_points:9d} points  {mesh.n_cells:9d} triangles  "
+              f"area {mesh.area:12.1f}  open edges {open_edges}")
+    print(f"Speedup: {single_time / bricked_time:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bricked parallel marching cubes against a single contour call")
+    parser.add_argument("--volume", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "shoulder.vti"))
+    parser.add_argument("--isovalue", type=float, default=1200)
+    parser.add_argument("--method", default="marching_cubes")
+    parser.add_argument("--upsample", type=float, default=2, help="Zoom factor per axis, to benchmark a larger volume")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per variant, the fastest one is reported")
+    options = parser.parse_args()
+
+    volume = pv.read(options.volume)
+    if options.upsample != 1:
+        scalars = np.asarray(volume.active_scalars).reshape(volume.dimensions, order="F")
+        scalars = zoom(scalars, options.upsample, order=1)
+        volume = pv.ImageData(dimensions=scalars.shape, spacing=np.asarray(volume.spacing) / options.upsample,
+                              origin=volume.origin)
+        volume.point_data["scalars"] = scalars.ravel(order="F")
+    benchmark(volume, options.isovalue, options.method, options.workers, options.repeat)
+
+
+if __name__ == "__main__":
+    main()
+
+# Example usage:
+# Shoulder volume upsampled to 8 times the points, on all cores:
+# python bricked_contour.py
+#
+# Original resolution with 4 workers:
+# python bricked_contour.py --upsample 1 --workers 4
@@ -0,0 +1,160 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+import pydicom
+import pyvista as pv
+
+from mesh_cache import mesh_cache
+from patient_space import hu_to_scalar, place_in_patient
+
+# The DICOM loading code (series index, volume cache, rescale and spacing) lives in the UE3 exercise
+UE3_EXERCISE_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+                                                 "UE3", "Exercise"))
+DATASETS_DIR = os.path.join(UE3_EXERCISE_DIR, "Datasets_UE3")
+DATASETS = ["Aneurysm", "HeadNeck", "Lungs"]
+
+
+def use_ue3_modules():
+    """Makes the UE3 modules importable. Called by the functions that need them, importing this module changes nothing."""
+    if UE3_EXERCISE_DIR not in sys.path:
+        sys.path.append(UE3_EXERCISE_DIR)
+
+
+def read_geometry(dicom_files):
+    """
+    Returns the (origin, direction matrix) of a series in patient coordinates (mm), reading only headers.
+
+    The origin is the ImagePositionPatient of the first file. The columns of the direction matrix are the
+    directions in which the column index, the row index and the slice index grow: the two ImageOrientationPatient
+    cosines and the direction from the first to the second slice (series are often stored head to feet, so this
+    is usually -z).
+    """
+    first = pydicom.dcmread(dicom_files[0], stop_before_pixels=True)
+    origin = np.array(first.get("ImagePositionPatient", [0, 0, 0]), dtype=float)
+    orientation = np.array(first.get("ImageOrientationPatient", [1, 0, 0, 0, 1, 0]), dtype=float)
+    row_direction, column_direction = orientation[:3], orientation[3:]
+    slice_direction = np.cross(row_direction, column_direction)
+    if len(dicom_files) > 1 and "ImagePositionPatient" in first:
+        second = pydicom.dcmread(dicom_files[1], stop_before_pixels=True)
+        if "ImagePositionPatient" in second:
+            step = np.subtract(second.ImagePositionPatient, first.ImagePositionPatient, dtype=float)
+            if np.linalg.norm(step) > 0:
+                slice_direction = step / np.linalg.norm(step)
+    return origin, np.column_stack((row_direction, column_direction, slice_direction))
+
+
+def volume_to_image_data(volume, spacing, origin=(0, 0, 0), direction=None, slope=1.0, intercept=0.0,
+                         name="ImageFile"):
+    """
+    Wraps a (slices, rows, columns) volume as a pv.ImageData without copying the voxels.
+
+    A C-ordered volume already has the point order of an ImageData with dimensions (columns, rows, slices), so
+    its flat view is used as the point data directly (a memory-mapped volume stays memory-mapped). The image
+    has the voxel spacing in mm but is axis-aligned at the origin, the placement in patient coordinates is kept
+    as a 4x4 matrix in the field data and applied to the actors (see place_in_patient). Series stored head to
+    feet have a mirrored direction matrix, which the volume mappers do not render correctly on the image
+    itself, while actor matrices are supported by every mapper.
+    The scalars are the stored pixel values, the rescale parameters are kept in the field data, see
+    hu_to_scalar.
+
+    Parameters:
+        volume (np.ndarray): The volume, C-contiguous, with shape (n_slices, rows, cols).
+        spacing (tuple): The (slice, row, column) voxel spacing in mm, see read_spacing.
+        origin (tuple): Position of the first voxel in patient coordinates (mm).
+        direction (np.ndarray): 3x3 direction matrix, see read_geometry. Defaults to the identity.
+        slope (float): RescaleSlope of the series.
+        intercept (float): RescaleIntercept of the series.
+        name (str): Name of the point data array.
+
+    Returns:
+        pv.ImageData: The volume, sharing its memory.
+    """
+    use_ue3_modules()
+    from dicom_volume import as_array
+
+    volume = as_array(volume)
+    if not volume.flags.c_contiguous:
+        raise ValueError("volume_to_image_data needs a C-contiguous volume, a copy would defeat the purpose")
+    slice_spacing, row_spacing, column_spacing = spacing
+    image = pv.ImageData(dimensions=volume.shape[::-1], spacing=(column_spacing, row_spacing, slice_spacing))
+    image.point_data[name] = volume.reshape(-1)
+    image.set_active_scalars(name)
+
+    image_to_patient = np.eye(4)
+    image_to_patient[:3, :3] = np.eye(3) if direction is None else direction
+    image_to_patient[:3, 3] = origin
+    image.field_data["ImageToPatient"] = image_to_patient.ravel()
+    image.field_data["RescaleSlope"] = [slope]
+    image.field_data["RescaleIntercept"] = [intercept]
+    return image
+
+
+def open_dicom_image(directory, workers=None):
+    """
+    Returns the largest series in a DICOM directory as a pv.ImageData, without writing any .vti file.
+
+    The series is indexed and loaded through the UE3 caches, so after the first time the image is a view of
+    the memory-mapped volume cache and opens without decoding a single DICOM file.
+    """
+    use_ue3_modules()
+    from dicom_index import find_series_files
+    from dicom_volume import load_cached_volume, read_rescale, read_spacing
+
+    dicom_files, _ = find_series_files(directory, workers=workers)
+    if not dicom_files:
+        raise FileNotFoundError(f"No DICOM series found in {directory}")
+    volume = load_cached_volume(dicom_files, workers=workers)
+    origin, direction = read_geometry(dicom_files)
+    slope, intercept = read_rescale(dicom_files[0])
+    return volume_to_image_data(volume, read_spacing(dicom_files), origin, direction, slope, intercept)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a UE3 DICOM series with the UE4 renderers")
+    parser.add_argument("dataset", nargs="?", default="Aneurysm",
+                        help=f"One of {', '.join(DATASETS)} or the path of a DICOM directory")
+    parser.add_argument("--mode", choices=["surface", "volume"], default="surface")
+    parser.add_argument("--isovalue", type=float, default=300, help="Isovalue of the surface in HU (bone: ~300)")
+    parser.add_argument("--cmap", default="bone")
+    parser.add_argument("--opacity", default="sigmoid")
+    parser.add_argument("--window", type=float, nargs=2, default=[-100, 1500],
+                        help="HU range the colormap and opacity of the volume rendering are spread over")
+    parser.add_argument("--screenshot", help="Save a screenshot instead of opening an interactive window")
+    options = parser.parse_args()
+
+    directory = os.path.join(DATASETS_DIR, options.dataset) if options.dataset in DATASETS else options.dataset
+    image = open_dicom_image(directory)
+    print(f"{directory}: {image.dimensions} voxels, spacing {image.spacing}")
+
+    pl = pv.Plotter(off_screen=options.screenshot is not None, title=os.path.basename(directory))
+    if options.mode == "surface":
+        mesh = mesh_cache.contour(image, hu_to_scalar(image, options.isovalue), method="marching_cubes")
+        actor = pl.add_mesh(mesh, color="salmon", ambient=0.5, diffuse=0.8, specular=0.2)
+    else:
+        clim = [hu_to_scalar(image, hu) for hu in options.window]
+        actor = pl.add_volume(image, cmap=options.cmap, opacity=options.opacity, clim=clim, shade=True, mapper="smart")
+    place_in_patient(actor, image)
+    pl.reset_camera()
+    pl.camera_position = "xz"
+    pl.camera.elevation = 20
+    if options.screenshot:
+        pl.screenshot(options.screenshot)
+        pl.close()
+    else:
+        pl.show()
+
+
+if __name__ == "__main__":
+    main()
+
+# Example usage:
+# Bone surface (300 HU) of the Aneurysm series:
+# python dicom_bridge.py Aneurysm
+#
+# Volume rendering of the HeadNeck series:
+# python dicom_bridge.py HeadNeck --mode volume
+#
+# In the UE4 scripts, any series can replace shoulder.vti (its actors are then placed with place_in_patient):
+# volume_data = open_dicom_image(os.path.join(DATASETS_DIR, "Lungs"))
@@ -1,27 +1,123 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import numpy as np
 import pyvista as pv
 
-volume_data = pv.read("shoulder.vti")
+from mesh_cache import mesh_cache
+from patient_space import place_in_patient
+from volume_access import open_volume
+
+volume_file = open_volume("shoulder.vti")
+volume_data = volume_file.image
 
-# Extract the range of scalar values in the dataset for setting isovalue)
-volume_data_min = volume_data.active_scalars.min()
-volume_data_max = volume_data.active_scalars.max()
+# Range of scalar values in the dataset for setting isovalue (precomputed in the volume cache)
+volume_data_min, volume_data_max = volume_file.scalar_range
 print(f"Scalar range: {volume_data_min} to {volume_data_max}")
 
 
 class MarchingCubesMesh():
-    def __init__(self, isovalue, color='gray', opacity=1.0, ambient=0., diffuse=1., specular=0.):
+    """
+    Isosurface of volume_data (or of another volume, e.g. a DICOM series from dicom_bridge.open_dicom_image),
+    optionally with an isovalue slider.
+
+    While the slider is dragged, the surface is extracted from a copy of the volume downsampled by preview_rate
+    (preview_rate ** 3 times fewer voxels). When the slider is released, a background worker extracts the
+    full-resolution surface (decimated by the fraction decimate, if given) and swaps it in. A newer release makes
+    older extractions stale: queued ones are cancelled, the result of a running one is dropped.
+
+    method='bricked' extracts the full-resolution surfaces on a process pool (see bricked_contour). Use it only
+    for large volumes on several cores, on one or two cores it is slower than the default 'marching_cubes'.
+    """
+
+    def __init__(self, isovalue, color='gray', opacity=1.0, ambient=0., diffuse=1., specular=0., plotter=None,
+                 slider=False, preview_rate=2, decimate=0.0, volume=None, method='marching_cubes'):
         self.mesh = None
+        self.volume = volume if volume is not None else volume_data
+        self.method = method
+        self.process_pool = ProcessPoolExecutor() if method == 'bricked' else None  # Reused by every extraction
 
         # Task: change the isovalue variable to extract the isosurface that corresponds to the bones
         self.isovalue = isovalue
-
-        # Generate the isosurface using the marching cubes algorithm
-        self.mesh = volume_data.contour([self.isovalue], method='marching_cubes')
-
-        # Add the mesh to the plotter with visualization parameters
-        pl.add_mesh(self.mesh, color=color, opacity=opacity, ambient=ambient, diffuse=diffuse, specular=specular)
-        print(f"Marching cubes mesh created with isovalue: {self.isovalue}")
+        self.plotter = plotter if plotter is not None else pl
+        self.decimate = decimate
+
+        # Generate the isosurface using the marching cubes algorithm (or reuse it, if this volume and isovalue
+        # were extracted before, also in an earlier session). The mesh object stays the one the actor renders,
+        # new surfaces are shallow-copied into it.
+        self.mesh = pv.PolyData()
+        self.mesh.shallow_copy(self.extract_full(self.isovalue))
+
+        # Add the mesh to the plotter with visualization parameters (DICOM series are moved to patient coordinates)
+        actor = self.plotter.add_mesh(self.mesh, color=color, opacity=opacity, ambient=ambient, diffuse=diffuse, specular=specular)
+        place_in_patient(actor, self.volume)
+        print(f"Marching cubes mesh with isovalue: {self.isovalue} ({mesh_cache.stats()})")
+
+        if slider:
+            self.add_isovalue_slider(preview_rate)
+
+    def add_isovalue_slider(self, preview_rate=2):
+        nx, ny, nz = self.volume.dimensions
+        self.preview_volume = self.volume.extract_subset((0, nx - 1, 0, ny - 1, 0, nz - 1), rate=(preview_rate,) * 3, boundary=True)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None  # Future of the newest full-resolution extraction
+        self.generation = 0  # Incremented for every release, results of older generations are dropped
+        self.poll_timer = None
+        self.dragging = False  # Previews are only shown between the Start- and EndInteractionEvent of the slider
+
+        slider_widget = self.plotter.add_slider_widget(
+            self.preview_callback,
+            [volume_data_min, volume_data_max] if self.volume is volume_data else self.volume.get_data_range(),
+            value=self.isovalue,
+            title='Isovalue',
+            pointa=(0.1, 0.9),
+            pointb=(0.6, 0.9),
+            interaction_event='always'
+        )
+        slider_widget.AddObserver('StartInteractionEvent', self.press_callback)
+        slider_widget.AddObserver('EndInteractionEvent', self.release_callback)
+        self.plotter.iren.add_observer('TimerEvent', self.poll_callback)
+
+    def extract_full(self, isovalue):
+        mesh = mesh_cache.contour(self.volume, isovalue, method=self.method, executor=self.process_pool)
+        if self.decimate > 0 and mesh.n_points > 0:
+            mesh = mesh.decimate(self.decimate)
+        return mesh
+
+    def press_callback(self, widget, event):
+        self.dragging = True
+
+    def preview_callback(self, value):
+        # pyvista also calls the callback once when the slider is created, which must not replace the full-resolution surface
+        if not self.dragging:
+            return
+        # Coarse surface while dragging, full-resolution extractions of earlier releases are now stale
+        self.isovalue = int(round(value))  # Integer isovalues (the scalars are int16) keep the mesh cache small
+        self.generation += 1
+        self.mesh.shallow_copy(self.preview_volume.contour([self.isovalue], method='marching_cubes'))
+        self.plotter.render()
+
+    def release_callback(self, widget, event):
+        self.dragging = False
+        self.generation += 1
+        if self.pending is not None:
+            self.pending.cancel()  # Does nothing if it already runs, its result is dropped by the generation check
+        self.pending = self.executor.submit(self.extract_full, self.isovalue)
+        self.pending.generation = self.generation
+        if self.poll_timer is None:
+            self.poll_timer = self.plotter.iren.create_timer(50, repeating=True)
+
+    def poll_callback(self, obj, event):
+        # VTK objects are only touched from the render thread, the worker just returns the new mesh
+        if self.pending is None or not self.pending.done():
+            return
+        future, self.pending = self.pending, None
+        self.plotter.iren.destroy_timer(self.poll_timer)
+        self.poll_timer = None
+        if future.cancelled() or future.generation != self.generation:
+            return
+        self.mesh.shallow_copy(future.result())
+        self.plotter.render()
+        print(f"Marching cubes mesh with isovalue: {self.isovalue} ({mesh_cache.stats()})")
 
 
 # Experimentally determined isovalue to extract the bone structure
@@ -44,7 +140,8 @@ def plot_configurations():
         vis = MarchingCubesMesh(isovalue, color=color,
                     ambient=config["ambient"],
                     diffuse=config["diffuse"],
-                    specular=config["specular"])
+                    specular=config["specular"],
+                    plotter=pl)
         pl.show()
 
 
@@ -84,7 +181,8 @@ pl = pv.Plotter(title="Experimental configuration")  # Create a new plotter for
 vis = MarchingCubesMesh(isovalue, color=color,
             ambient=ambient,
             diffuse=diffuse,
-            specular=specular)
+            specular=specular,
+            slider=True)  # Drag the slider to explore other isovalues
 pl.show()
 
 # Note: I am no medial expert, but to me, it looks like the bone is fractured.
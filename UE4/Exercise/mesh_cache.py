@@ -0,0 +1,139 @@
+import hashlib
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pyvista as pv
+
+from bricked_contour import contour_bricked
+
+# Folder next to this script in which extracted meshes are kept between sessions
+MESH_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".mesh_cache")
+
+
+def volume_fingerprint(volume):
+    """Returns a hash over the geometry and the active scalars of a volume, so equal volumes share cached meshes."""
+    digest = hashlib.sha1()
+    digest.update(f"{volume.dimensions}:{volume.spacing}:{volume.origin}:{np.ravel(volume.direction_matrix).tolist()}:".encode())
+    scalars = np.ascontiguousarray(volume.active_scalars)
+    digest.update(f"{volume.active_scalars_name}:{scalars.dtype.str}:".encode())
+    digest.update(memoryview(scalars).cast("B"))
+    return digest.hexdigest()
+
+
+class MeshCache:
+    """
+    Cache of isosurfaces keyed by volume content and isovalue.
+
+    Meshes are kept in memory (the max_meshes most recently used ones) and saved as .vtp files in cache_dir,
+    so a new session reuses the surfaces extracted earlier instead of running marching cubes again. Changing
+    only how a mesh is rendered (color, lighting, opacity) therefore never re-extracts it.
+    """
+
+    def __init__(self, cache_dir=MESH_CACHE_DIR, max_meshes=8):
+        self.cache_dir = cache_dir
+        self.max_meshes = max_meshes
+        self.hits = 0
+        self.misses = 0
+        self._meshes = OrderedDict()
+        self._fingerprints = {}  # id of a volume -> (weakref, MTime, fingerprint), so a volume is hashed only once
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def contour(self, volume, isovalue, method="marching_cubes", executor=None):
+        """
+        Returns volume.contour([isovalue], method=method), from the cache if it was extracted before.
+
+        method="bricked" extracts the marching cubes surface with contour_bricked on a process pool (executor,
+        if given). It is opt-in: it only pays off for large volumes on several cores.
+        """
+        key = f"{self.fingerprint(volume)}_{float(isovalue):g}_{method}"
+        mesh = self._lookup(key)
+        if mesh is not None:
+            return mesh
+
+        # One lock per key, so two threads that miss on the same mesh extract and write it only once
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            mesh = self._lookup(key)  # Extracted by another thread while this one waited
+            if mesh is not None:
+                return mesh
+            path = os.path.join(self.cache_dir, f"{key}.vtp") if self.cache_dir else None
+            if path is not None and os.path.exists(path):
+                mesh = pv.read(path)
+                hit = True
+            else:
+                if method == "bricked":
+                    mesh = contour_bricked(volume, isovalue, method="marching_cubes", executor=executor)
+                else:
+                    mesh = volume.contour([isovalue], method=method)
+                hit = False
+                if path is not None:
+                    self._save(mesh, path)
+            with self._lock:
+                if hit:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            self._store(key, mesh)
+        return mesh
+
+    def fingerprint(self, volume):
+        # Keyed by id, but checked against a weak reference: a garbage-collected volume drops its entry, and
+        # a new volume that reuses its id never gets the old fingerprint
+        volume_id, mtime = id(volume), volume.GetMTime()
+        with self._lock:
+            entry = self._fingerprints.get(volume_id)
+        if entry is not None and entry[0]() is volume and entry[1] == mtime:
+            return entry[2]
+        fingerprint = volume_fingerprint(volume)
+        reference = weakref.ref(volume, lambda reference: self._forget(volume_id, reference))
+        with self._lock:
+            self._fingerprints[volume_id] = (reference, mtime, fingerprint)
+        return fingerprint
+
+    def clear(self):
+        """Drops the meshes held in memory (the .vtp files stay)."""
+        with self._lock:
+            self._meshes.clear()
+
+    def stats(self):
+        return f"{len(self._meshes)} meshes in memory, {self.hits} hits, {self.misses} misses"
+
+    def _lookup(self, key):
+        with self._lock:
+            mesh = self._meshes.get(key)
+            if mesh is not None:
+                self._meshes.move_to_end(key)
+                self.hits += 1
+            return mesh
+
+    def _forget(self, volume_id, reference):
+        with self._lock:
+            entry = self._fingerprints.get(volume_id)
+            if entry is not None and entry[0] is reference:
+                del self._fingerprints[volume_id]
+
+    def _store(self, key, mesh):
+        with self._lock:
+            self._meshes[key] = mesh
+            self._meshes.move_to_end(key)
+            while len(self._meshes) > self.max_meshes:
+                self._meshes.popitem(last=False)
+
+    def _save(self, mesh, path):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a temporary file first, so an interrupted write never leaves a truncated mesh behind
+            temporary_path = path[:-len(".vtp")] + ".tmp.vtp"
+            mesh.save(temporary_path)
+            os.replace(temporary_path, path)
+        except OSError as e:
+            print(f"Warning: Could not write mesh cache to {self.cache_dir}: {e}")
+
+
+# Shared by all scripts of a session
+mesh_cache = MeshCache()
@@ -0,0 +1,13 @@
+import numpy as np
+
+
+def place_in_patient(actor, image):
+    """Moves an actor showing image (or a mesh extracted from it) to patient coordinates."""
+    if "ImageToPatient" in image.field_data:
+        actor.user_matrix = np.reshape(image.field_data["ImageToPatient"], (4, 4))
+    return actor
+
+
+def hu_to_scalar(image, hu):
+    """Converts Hounsfield units (e.g. an isovalue) to the stored values of an image from dicom_bridge.volume_to_image_data."""
+    return (hu - image.field_data["RescaleIntercept"][0]) / image.field_data["RescaleSlope"][0]
@@ -0,0 +1,235 @@
+import argparse
+import os
+import time
+from functools import lru_cache
+
+import numpy as np
+import pyvista as pv
+from matplotlib import colormaps
+from matplotlib.image import imsave
+
+from volume_access import open_volume
+
+AXES = {"x": 0, "y": 1, "z": 2}
+
+# Entries of the color and opacity lookup tables (like the 256 entry transfer functions pyvista creates)
+LUT_SIZE = 256
+
+
+@lru_cache(maxsize=32)
+def transfer_lut(cmap, opacity, n=LUT_SIZE):
+    """
+    Returns the RGBA lookup table of a colormap and an opacity transfer function, float32 with shape (n, 4).
+
+    opacity is anything pv.opacity_transfer_function understands ('linear', 'sigmoid', 'geom', ...), so the
+    previews use the same transfer functions as add_volume.
+    """
+    lut = colormaps[cmap](np.linspace(0, 1, n)).astype(np.float32)
+    lut[:, 3] = pv.opacity_transfer_function(opacity, n) / 255
+    return lut
+
+
+class ProjectionPreview:
+    """
+    Fast approximations of volume renderings as axis-aligned projections computed with NumPy.
+
+    Maximum and average blending along a view axis are max and mean reductions, composite blending is
+    front-to-back alpha compositing, vectorized with a cumulative product of the transparencies. The volume is
+    processed in chunks of chunk_size slices along z (its slowest axis in memory), so a memory-mapped volume is
+    read sequentially and only one chunk of colors and opacities exists at a time. Values are mapped to colors
+    and opacities through precomputed tables with one entry per integer value (no per-voxel arithmetic).
+    Shading and perspective are ignored, the result is a thumbnail of the rendering, not a replacement for it.
+    """
+
+    # Entries of the value tables of float volumes, which are quantized over their value range
+    FLOAT_TABLE_SIZE = 4096
+
+    def __init__(self, volume, step=1, chunk_size=16, opacity_unit_distance=20, background=(1.0, 1.0, 1.0)):
+        """
+        Parameters:
+            volume: A pv.ImageData, the path of a volume file or the path of a DICOM directory.
+            step (int): Use every step-th voxel along each axis (2 gives 8 times less work for thumbnails).
+            chunk_size (int): Slices along z processed at once.
+            opacity_unit_distance (float): Distance over which a voxel has its full opacity, as in add_volume.
+            background (tuple): RGB background color the projection is blended onto.
+        """
+        image, value_range = self._load(volume)
+        self.step = step
+        self.chunk_size = chunk_size
+        self.opacity_unit_distance = opacity_unit_distance
+        self.background = np.asarray(background, dtype=np.float32)
+
+        # Scalars indexed [x, y, z] (a view of the point data), axes mirrored in patient space are flipped back
+        scalars = np.asarray(image.active_scalars).reshape(image.dimensions, order="F")
+        if "ImageToPatient" in image.field_data:
+            direction = np.reshape(image.field_data["ImageToPatient"], (4, 4))[:3, :3]
+            scalars = scalars[tuple(slice(None, None, -1) if d < 0 else slice(None) for d in np.diag(direction))]
+        self.scalars = scalars[::step, ::step, ::step]
+        self.spacing = np.asarray(image.spacing) * step
+        self.value_range = tuple(float(value) for value in value_range)
+        self.integer = np.issubdtype(self.scalars.dtype, np.integer)
+        if self.integer:
+            self.table_values = np.arange(int(self.value_range[0]), int(self.value_range[1]) + 1)
+        else:
+            self.table_values = np.linspace(*self.value_range, self.FLOAT_TABLE_SIZE)
+
+    @staticmethod
+    def _load(volume):
+        """Returns the ImageData and the (min, max) of the scalars of a volume, image or path."""
+        if isinstance(volume, pv.ImageData):
+            return volume, volume.get_data_range()
+        if os.path.isdir(volume):
+            from dicom_bridge import open_dicom_image  # Needs pydicom and the UE3 modules, only for DICOM input
+            image = open_dicom_image(volume)
+            return image, image.get_data_range()
+        volume_file = open_volume(volume)
+        return volume_file.image, volume_file.scalar_range
+
+    def render(self, blending="maximum", cmap="gray", opacity="linear", axis="y", window=None):
+        """
+        Returns the projection of the volume along axis as an RGB uint8 image.
+
+        The views match the pyvista camera positions 'yz', 'xz' and 'xy' (for axis 'x', 'y' and 'z'), e.g. for
+        axis 'y' x points right and z points up.
+
+        Parameters:
+            blending (str): 'maximum', 'average' or 'composite'.
+            cmap (str): Matplotlib colormap.
+            opacity (str): Opacity transfer function, see transfer_lut.
+            axis (str): View axis, 'x', 'y' or 'z'.
+            window (tuple): (low, high) scalar range the transfer functions are spread over. Defaults to the
+                scalar range of the volume, like add_volume.
+        """
+        if blending not in ("maximum", "average", "composite"):
+            raise ValueError(f"Unknown blending: {blending}")
+        axis = AXES[axis]
+        table = self._table(cmap, opacity, window)
+        # Order the view axis front to back (the 'yz' and 'xy' cameras look from the high end of the axis)
+        scalars = self.scalars[tuple(slice(None, None, -1) if a == axis and axis != 1 else slice(None) for a in range(3))]
+
+        if blending == "composite":
+            # Opacity per sample, corrected for the distance between samples, and premultiplied colors
+            alpha = 1 - (1 - np.minimum(table[:, 3:], 0.999)) ** (self.spacing[axis] / self.opacity_unit_distance)
+            rgba = self._composite(scalars, axis, np.concatenate((table[:, :3] * alpha, alpha), axis=1))
+            color = rgba[..., :3] + self.background * (1 - rgba[..., 3:])
+        else:
+            rgba = table[self._indices(self._reduce(scalars, axis, blending))]
+            color = rgba[..., :3] * rgba[..., 3:] + self.background * (1 - rgba[..., 3:])
+
+        image = (np.clip(color, 0, 1) * 255).astype(np.uint8)
+        remaining = [a for a in range(3) if a != axis]
+        image = np.swapaxes(image, 0, 1)[::-1]  # Rows along the second remaining axis, pointing up
+        return self._square_pixels(image, self.spacing[remaining[1]], self.spacing[remaining[0]])
+
+    def _table(self, cmap, opacity, window):
+        """Returns the RGBA of every entry of table_values, with the transfer functions spread over window."""
+        low, high = window if window is not None else self.value_range
+        lut = transfer_lut(cmap, opacity)
+        positions = np.clip((self.table_values - low) * (len(lut) - 1) / max(high - low, 1e-12), 0, len(lut) - 1)
+        return lut[np.rint(positions).astype(np.intp)]
+
+    def _indices(self, values):
+        """Returns the table entries of values."""
+        if self.integer:
+            values = values if np.issubdtype(values.dtype, np.integer) else np.rint(values)
+            return values.astype(np.intp) - int(self.value_range[0])
+        scale = (len(self.table_values) - 1) / max(self.value_range[1] - self.value_range[0], 1e-12)
+        return np.clip(np.rint((values - self.value_range[0]) * scale), 0, len(self.table_values) - 1).astype(np.intp)
+
+    def _chunks(self, scalars):
+        for start in range(0, scalars.shape[2], self.chunk_size):
+            yield scalars[:, :, start:start + self.chunk_size]
+
+    def _reduce(self, scalars, axis, blending):
+        """Maximum or mean of scalars along axis, one chunk along z at a time."""
+        if axis == 2:
+            # The chunks lie behind each other, their partial results are combined
+            result = None
+            for chunk in self._chunks(scalars):
+                if blending == "maximum":
+                    partial = chunk.max(axis=2)
+                    result = partial if result is None else np.maximum(result, partial)
+                else:
+                    partial = chunk.sum(axis=2, dtype=np.float64)
+                    result = partial if result is None else result + partial
+        else:
+            # The chunks lie next to each other, every chunk gives the projection of its own rows
+            if blending == "maximum":
+                parts = [chunk.max(axis=axis) for chunk in self._chunks(scalars)]
+            else:
+                parts = [chunk.sum(axis=axis, dtype=np.float64) for chunk in self._chunks(scalars)]
+            result = np.concatenate(parts, axis=1)
+        return result if blending == "maximum" else result / scalars.shape[axis]
+
+    def _composite(self, scalars, axis, premultiplied):
+        """Composites scalars front (index 0) to back along axis, returns premultiplied RGBA."""
+        def composite(rgba, along):
+            # Transparency of everything in front of each sample: cumulative product of (1 - alpha) without the
+            # sample itself (alpha is at most 0.999, so dividing it out is safe)
+            sample_transparency = 1 - rgba[..., 3:]
+            transparency = np.cumprod(sample_transparency, axis=along)
+            color = (transparency / sample_transparency * rgba[..., :3]).sum(axis=along)
+            return np.concatenate((color, 1 - np.take(transparency, -1, axis=along)), axis=-1)
+
+        if axis != 2:
+            parts = [composite(premultiplied[self._indices(chunk)], axis) for chunk in self._chunks(scalars)]
+            return np.concatenate(parts, axis=1)
+
+        result = np.zeros(scalars.shape[:2] + (4,), dtype=np.float32)
+        for chunk in self._chunks(scalars):
+            partial = composite(premultiplied[self._indices(chunk)], 2)
+            result += (1 - result[..., 3:]) * partial  # The chunk lies behind everything composited so far
+            if result[..., 3].min() > 0.99:
+                break  # Everything behind is hidden
+        return result
+
+    @staticmethod
+    def _square_pixels(image, row_spacing, column_spacing):
+        """Repeats rows or columns (nearest neighbour) so that anisotropic voxels are shown with their true size."""
+        if np.isclose(row_spacing, column_spacing):
+            return image
+        pixel = min(row_spacing, column_spacing)
+        rows = (np.arange(int(image.shape[0] * row_spacing / pixel)) * pixel / row_spacing).astype(np.intp)
+        columns = (np.arange(int(image.shape[1] * column_spacing / pixel)) * pixel / column_spacing).astype(np.intp)
+        return image[rows][:, columns]
+
+
+def save_previews(preview, config, output_dir, axes=("x", "y", "z")):
+    """Saves the previews of a rendering configuration (cmap, opacity, blending, name) and returns their paths."""
+    paths = []
+    for axis in axes:
+        path = os.path.join(output_dir, f"{config['name'].replace(' ', '_')}_preview_{axis}.png")
+        imsave(path, preview.render(config["blending"], config["cmap"], config["opacity"], axis))
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time NumPy projection previews of a volume")
+    parser.add_argument("volume", nargs="?", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "shoulder.vti"),
+                        help="A volume file or a DICOM directory")
+    parser.add_argument("--step", type=int, default=2, help="Voxel step of the thumbnails")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per preview, the fastest one is reported")
+    options = parser.parse_args()
+
+    preview = ProjectionPreview(options.volume, step=options.step)
+    print(f"Volume {preview.scalars.shape} (step {options.step}), value range {preview.value_range}")
+    for blending in ("maximum", "average", "composite"):
+        for axis in AXES:
+            times = []
+            for _ in range(options.repeat):
+                start = time.perf_counter()
+                image = preview.render(blending, "bone", "sigmoid", axis)
+                times.append(time.perf_counter() - start)
+            print(f"{blending:10s} {axis}  {image.shape[1]:4d}x{image.shape[0]:<4d} {min(times) * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
+
+# Example usage:
+# Preview timings for the shoulder volume:
+# python projection_preview.py
+#
+# Full resolution previews of a DICOM series:
+# python projection_preview.py ../../UE3/Exercise/Datasets_UE3/Aneurysm --step 1
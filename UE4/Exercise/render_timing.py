@@ -0,0 +1,62 @@
+import time
+
+import numpy as np
+
+# Render modes of vtkSmartVolumeMapper (GetLastUsedRenderMode), i.e. which mapper it actually delegated to
+SMART_RENDER_MODES = {0: "default", 1: "ray cast (CPU)", 2: "GPU ray cast", 3: "OSPRay", 4: "ANARI", 5: "undefined",
+                      6: "invalid"}
+
+
+def mapper_description(actor):
+    """Returns the mapper class of an actor, for smart volume mappers with the render mode they picked."""
+    mapper = actor.GetMapper()
+    name = mapper.GetClassName()
+    if hasattr(mapper, "GetLastUsedRenderMode"):
+        mode = mapper.GetLastUsedRenderMode()
+        name += f" ({SMART_RENDER_MODES.get(mode, mode)})"
+    return name
+
+
+def measure_render_timing(pl, actor=None, n_frames=36):
+    """
+    Times the rendering of a plotter scene: the first frame and the frames of a camera orbit.
+
+    Must be called before the scene is rendered for the first time, because the first frame includes the
+    one-time setup (e.g. uploading the volume and transfer functions to textures), which is what a user waits
+    for after opening the window. The orbit then renders n_frames frames while rotating the camera once
+    around the scene (azimuth), like dragging it with the mouse. The camera is restored afterwards.
+
+    Parameters:
+        pl (pv.Plotter): The plotter, with the scene set up but not rendered yet.
+        actor: Optional actor whose mapper is reported.
+        n_frames (int): Number of frames of the orbit.
+
+    Returns:
+        dict: first_frame_ms, mean_frame_ms, p95_frame_ms, orbit_frames, window_size and mapper (JSON serializable).
+    """
+    render_window = pl.render_window
+    camera_position = pl.camera_position
+
+    start = time.perf_counter()
+    render_window.Render()
+    first_frame = time.perf_counter() - start
+
+    frame_times = []
+    for _ in range(n_frames):
+        pl.camera.azimuth += 360 / n_frames
+        start = time.perf_counter()
+        render_window.Render()
+        frame_times.append(time.perf_counter() - start)
+    pl.camera_position = camera_position
+
+    frame_times_ms = np.array(frame_times) * 1000
+    timing = {
+        "first_frame_ms": round(first_frame * 1000, 1),
+        "mean_frame_ms": round(float(frame_times_ms.mean()), 1),
+        "p95_frame_ms": round(float(np.percentile(frame_times_ms, 95)), 1),
+        "orbit_frames": n_frames,
+        "window_size": list(render_window.GetSize()),
+    }
+    if actor is not None:
+        timing["mapper"] = mapper_description(actor)
+    return timing
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pyvista as pv
+
+# Name of the folder next to a volume file in which its raw scalars and statistics are cached
+CACHE_DIR_NAME = ".volume_cache"
+
+# Percentiles stored with every volume, e.g. for robust slider ranges and transfer functions
+PERCENTILES = [0.5, 1, 5, 25, 50, 75, 95, 99, 99.5]
+
+HISTOGRAM_BINS = 256
+
+
+def file_fingerprint(path):
+    """Returns a hash over the name, size and modification time of a file."""
+    stat = os.stat(path)
+    return hashlib.sha1(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+
+
+def compute_statistics(scalars, percentiles=PERCENTILES, bins=HISTOGRAM_BINS):
+    """Returns the scalar range, percentiles and histogram of an array as a JSON serializable dict."""
+    scalars = np.asarray(scalars).ravel()
+    scalar_min, scalar_max = float(scalars.min()), float(scalars.max())
+    counts, edges = np.histogram(scalars, bins=bins, range=(scalar_min, scalar_max))
+    return {
+        "range": [scalar_min, scalar_max],
+        "percentiles": {f"{q:g}": float(value) for q, value in zip(percentiles, np.percentile(scalars, percentiles))},
+        "histogram": {"counts": counts.tolist(), "edges": edges.tolist()},
+    }
+
+
+class VolumeFile:
+    """
+    Lazy access to a volume file (.vti or anything else pv.read understands) through an on-disk cache.
+
+    The first time a file is opened it is parsed once, its active scalars are stored as a raw .npy file and
+    its geometry and statistics (scalar range, percentiles, histogram) in a JSON sidecar, both named after
+    the file fingerprint. Afterwards the statistics are read from the sidecar without touching the scalars,
+    and the volume is an ImageData around the read-only memory-mapped .npy file, built only when it is used.
+    Opening a modified file writes a new entry and deletes the stale one.
+    """
+
+    def __init__(self, path, cache_dir=None):
+        self.path = os.path.abspath(path)
+        self.cache_dir = cache_dir or os.path.join(os.path.dirname(self.path), CACHE_DIR_NAME)
+        self.name = os.path.splitext(os.path.basename(self.path))[0]
+        self.key = f"{self.name}_{file_fingerprint(self.path)}"
+        self._meta = None
+        self._scalars = None
+        self._image = None
+
+    @property
+    def meta(self):
+        """Geometry and statistics of the volume, from the cache if possible."""
+        if self._meta is None:
+            self._meta = self._read_meta()
+            if self._meta is None:
+                self._build_cache()
+        return self._meta
+
+    @property
+    def scalars(self):
+        """The active scalars as a flat read-only memory map (point order of the ImageData)."""
+        if self._scalars is None:
+            meta = self.meta
+            if self._scalars is None:
+                scalars = np.load(self._volume_path, mmap_mode="r")
+                if scalars.shape != (np.prod(meta["dimensions"]),) or str(scalars.dtype) != meta["dtype"]:
+                    self._build_cache()
+                else:
+                    self._scalars = scalars
+        return self._scalars
+
+    @property
+    def image(self):
+        """The volume as a pv.ImageData whose point data is the memory-mapped scalars (no copy)."""
+        if self._image is None:
+            meta = self.meta
+            image = pv.ImageData(dimensions=meta["dimensions"], spacing=meta["spacing"], origin=meta["origin"])
+            image.point_data[meta["scalars_name"]] = self.scalars
+            image.set_active_scalars(meta["scalars_name"])
+            self._image = image
+        return self._image
+
+    @property
+    def scalar_range(self):
+        """The (min, max) of the scalars."""
+        return tuple(self.meta["statistics"]["range"])
+
+    def percentile(self, q):
+        """Returns the q-th percentile of the scalars, q must be one of PERCENTILES."""
+        return self.meta["statistics"]["percentiles"][f"{q:g}"]
+
+    @property
+    def histogram(self):
+        """The (counts, bin edges) of the scalars over the scalar range."""
+        histogram = self.meta["statistics"]["histogram"]
+        return np.array(histogram["counts"]), np.array(histogram["edges"])
+
+    @property
+    def _volume_path(self):
+        return os.path.join(self.cache_dir, f"{self.key}.npy")
+
+    @property
+    def _meta_path(self):
+        return os.path.join(self.cache_dir, f"{self.key}.json")
+
+    def _read_meta(self):
+        if not (os.path.exists(self._volume_path) and os.path.exists(self._meta_path)):
+            return None
+        try:
+            with open(self._meta_path, "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if meta.get("key") == self.key else None
+
+    def _build_cache(self):
+        """Parses the volume file and writes its cache entry (the parsed scalars are used if writing fails)."""
+        volume = pv.read(self.path)
+        scalars = np.asarray(volume.active_scalars)
+        self._meta = {
+            "key": self.key,
+            "dimensions": list(volume.dimensions),
+            "spacing": list(volume.spacing),
+            "origin": list(volume.origin),
+            "scalars_name": volume.active_scalars_name,
+            "dtype": str(scalars.dtype),
+            "statistics": compute_statistics(scalars),
+        }
+        self._scalars = scalars
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._remove_stale_entries()
+            # Write to temporary files first, so an interrupted write never leaves a valid looking entry behind
+            np.save(self._volume_path + ".tmp.npy", scalars)
+            os.replace(self._volume_path + ".tmp.npy", self._volume_path)
+            with open(self._meta_path + ".tmp", "w") as f:
+                json.dump(self._meta, f, indent=4)
+            os.replace(self._meta_path + ".tmp", self._meta_path)
+        except OSError as e:
+            print(f"Warning: Could not write volume cache to {self.cache_dir}: {e}")
+
+    def _remove_stale_entries(self):
+        """Deletes the cache entries of earlier versions of this file."""
+        for filename in os.listdir(self.cache_dir):
+            stem = filename.split(".", 1)[0]
+            if stem.rsplit("_", 1)[0] == self.name and stem != self.key:
+                try:
+                    os.remove(os.path.join(self.cache_dir, filename))
+                except OSError:
+                    pass  # Still memory-mapped by another process (Windows), removed on the next rebuild
+
+
+_open_volumes = {}
+
+
+def open_volume(path, cache_dir=None):
+    """Returns the VolumeFile of a path, shared by all scripts of a session."""
+    key = (os.path.abspath(path), cache_dir)
+    if key not in _open_volumes:
+        _open_volumes[key] = VolumeFile(path, cache_dir)
+    return _open_volumes[key]
@@ -0,0 +1,88 @@
+import pyvista as pv
+from pyvista.plotting.mapper import FixedPointVolumeRayCastMapper, GPUVolumeRayCastMapper
+
+# Frames per second the interactor asks the renderers for while the user interacts (vtkRenderWindowInteractor's
+# DesiredUpdateRate), the low resolution mapper casts fewer rays until its frames are fast enough for it
+DESIRED_UPDATE_RATE = 15.0
+
+# Largest distance in pixels between the rays of the low resolution mapper (4: one ray per 4x4 pixels)
+MAXIMUM_IMAGE_SAMPLE_DISTANCE = 4
+
+
+def downsampled_volume(volume, rate):
+    """Returns a copy of an ImageData with every rate-th point along each axis."""
+    nx, ny, nz = volume.dimensions
+    return volume.extract_subset((0, nx - 1, 0, ny - 1, 0, nz - 1), rate=(rate,) * 3, boundary=True)
+
+
+class VolumeLOD:
+    """
+    Level of detail for a volume actor: a downsampled copy is rendered while the user interacts.
+
+    The low resolution actor has rate ** 3 times fewer voxels and shares the vtkVolumeProperty (color,
+    opacity, shading) of the full resolution actor, so transfer function changes apply to both. It is shown
+    instead of the full resolution actor between the Start- and EndInteractionEvent of the interactor style
+    (rotating, panning, zooming) and of any tracked widget (e.g. the transfer function sliders), after the
+    interaction the full resolution volume is rendered again.
+
+    Fewer voxels alone barely help a software ray caster, whose cost is rays times samples per ray. The low
+    resolution mapper therefore samples each ray at the spacing of the downsampled volume (rate times fewer
+    samples) and adjusts the number of rays to the desired update rate (with llvmpipe on one core a shaded
+    800x600 frame of shoulder.vti takes ~0.4 s instead of ~4 s with the smart mapper).
+    """
+
+    def __init__(self, plotter, actor, volume, rate=2, desired_update_rate=DESIRED_UPDATE_RATE):
+        """
+        Parameters:
+            plotter (pv.Plotter): The plotter the actor was added to.
+            actor (pv.Volume): The full resolution actor, as returned by add_volume.
+            volume (pv.ImageData): The volume the actor renders.
+            rate (int): Downsampling rate of the interaction volume along each axis.
+            desired_update_rate (float): Frames per second to aim for while interacting.
+        """
+        self.plotter = plotter
+        self.actor = actor
+        self.interacting = 0  # Number of running interactions (a slider can be dragged while a key rotates)
+
+        # Same blending and scalars as the full resolution actor, but with the downsampled volume and a ray caster
+        # (the smart mapper does not expose the ray distances) of the same kind, CPU or GPU
+        full_mapper = actor.GetMapper()
+        self.low_volume = downsampled_volume(volume, rate)  # Lives as long as this LOD, i.e. the actor
+        mapper = FixedPointVolumeRayCastMapper() if full_mapper.IsA("vtkFixedPointVolumeRayCastMapper") else GPUVolumeRayCastMapper()
+        mapper.SetInputData(self.low_volume)
+        mapper.SetSampleDistance(min(self.low_volume.spacing))
+        mapper.SetAutoAdjustSampleDistances(True)  # Picks the distance between rays from the desired update rate
+        mapper.SetMinimumImageSampleDistance(1)
+        mapper.SetMaximumImageSampleDistance(MAXIMUM_IMAGE_SAMPLE_DISTANCE)
+        mapper.SetBlendMode(full_mapper.GetBlendMode())
+        mapper.SetScalarMode(full_mapper.GetScalarMode())
+        if full_mapper.GetArrayName():
+            mapper.SelectScalarArray(full_mapper.GetArrayName())
+        self.low_actor = pv.Volume()
+        self.low_actor.SetMapper(mapper)
+        self.low_actor.SetProperty(actor.GetProperty())
+        self.low_actor.SetUserMatrix(actor.GetUserMatrix())
+        self.low_actor.VisibilityOff()
+        plotter.add_actor(self.low_actor, reset_camera=False, pickable=False)
+
+        interactor = plotter.iren.interactor
+        interactor.SetDesiredUpdateRate(desired_update_rate)
+        self.track(interactor.GetInteractorStyle())
+
+    def track(self, obj):
+        """Renders the low resolution volume during the interactions of obj (an interactor style or a widget)."""
+        obj.AddObserver("StartInteractionEvent", self.start_interaction)
+        obj.AddObserver("EndInteractionEvent", self.end_interaction)
+
+    def start_interaction(self, obj=None, event=None):
+        self.interacting += 1
+        if self.interacting == 1:
+            self.low_actor.VisibilityOn()
+            self.actor.VisibilityOff()
+
+    def end_interaction(self, obj=None, event=None):
+        self.interacting = max(self.interacting - 1, 0)
+        if self.interacting == 0:
+            self.actor.VisibilityOn()
+            self.low_actor.VisibilityOff()
+            self.plotter.render()
@@ -1,18 +1,37 @@
 import argparse
 import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 import numpy as np
 import pyvista as pv
 from IPython.core.display import Markdown
 from IPython.core.display_functions import display
 
-volume_data = pv.read("shoulder.vti")
+from projection_preview import AXES, ProjectionPreview, save_previews
+from render_timing import measure_render_timing
+from volume_access import open_volume
+from volume_lod import VolumeLOD
+
+volume_data = open_volume("shoulder.vti").image
 
 # Directory to save images
 output_dir = "rendered_images"
 os.makedirs(output_dir, exist_ok=True)
 
+# Fixed view and image size of the batch renderings, so all configurations are compared from the same camera
+batch_camera_position = "xz"
+batch_camera_elevation = 20
+batch_window_size = (1024, 768)
+
+# Frames of the camera orbit over which the batch renderings are timed
+orbit_frames = 36
+
+# Voxel step of the NumPy projection previews (2 uses every second voxel along each axis)
+preview_step = 2
+
 # Configurations for experimentation
 configurations = [
     {"cmap": "viridis", "opacity": "linear", "shade": True, "blending": "composite", "name": "Config 1"},
@@ -56,6 +75,19 @@ def load_configuration(config_name):
     return None
 
 
+def add_configuration_volume(pl, config):
+    """Add the volume to a plotter with the rendering settings of a configuration."""
+    return pl.add_volume(
+        volume_data,
+        cmap=config["cmap"],  # Colormap used for volume rendering (e.g., 'gray', 'viridis', 'plasma')
+        opacity=config["opacity"],  # Opacity function to control transparency (e.g., 'linear', 'sigmoid')
+        shade=config["shade"],  # Boolean to toggle shading (True adds light/shadow effects for depth)
+        blending=config["blending"],  # Blending mode for volume rendering ('composite', 'maximum', 'average')
+        opacity_unit_distance=20,  # Controls transparency scaling
+        mapper='smart'
+    )
+
+
 def render_configuration(config, screenshot=False):
     """Render a specific configuration interactively."""
     config_name = config["name"]
@@ -66,15 +98,8 @@ def render_configuration(config, screenshot=False):
     img_path = os.path.join(output_dir, f"{config_name.replace(' ', '_')}.png")
 
     pl = pv.Plotter(title=f"{config_name} - cmap: {cmap}, opacity: {opacity}, shade: {shade}, blending: {blending}")
-    pl.add_volume(
-        volume_data,
-        cmap=cmap,  # Colormap used for volume rendering (e.g., 'gray', 'viridis', 'plasma')
-        opacity=opacity,  # Opacity function to control transparency (e.g., 'linear', 'sigmoid')
-        shade=shade,  # Boolean to toggle shading (True adds light/shadow effects for depth)
-        blending=blending,  # Blending mode for volume rendering ('composite', 'maximum', 'average')
-        opacity_unit_distance=20,  # Controls transparency scaling
-        mapper='smart'
-    )
+    actor = add_configuration_volume(pl, config)
+    lod = VolumeLOD(pl, actor, volume_data)  # Downsampled volume while the view is rotated
 
     # Add a screenshot button (press 's' to save)
     def save_screenshot():
@@ -87,7 +112,11 @@ def render_configuration(config, screenshot=False):
     pl.show()
     pl.close()
 
-    # Save the configuration and description
+    # Save the configuration (with the timings of an earlier batch rendering, if the settings are the same)
+    # and description
+    previous = load_configuration(config_name)
+    if previous and "performance" in previous and {**config, "performance": previous["performance"]} == previous:
+        config = previous
     save_configuration(config_name, config)
     # Handle description
     current_desc = load_description(config_name)
@@ -111,10 +140,90 @@ def interactive_rendering(config_indices=None):
         render_configuration(configurations[idx])
 
 
+def render_offscreen(config, n_frames=orbit_frames, concurrent_renders=1):
+    """
+    Render a configuration off-screen at the fixed batch camera and save the screenshot and configuration.
+
+    Before the screenshot, the first frame and a camera orbit are timed (see render_timing.py), the timings
+    are saved with the configuration under "performance".
+    """
+    config_name = config["name"]
+    img_path = os.path.join(output_dir, f"{config_name.replace(' ', '_')}.png")
+
+    pl = pv.Plotter(off_screen=True, window_size=batch_window_size)
+    actor = add_configuration_volume(pl, config)
+    pl.camera_position = batch_camera_position
+    pl.camera.elevation = batch_camera_elevation
+    performance = measure_render_timing(pl, actor, n_frames=n_frames)
+    performance["concurrent_renders"] = concurrent_renders  # Renders sharing the CPU while this one was timed
+    pl.screenshot(img_path)
+    pl.close()
+
+    save_configuration(config_name, {**config, "performance": performance})
+    return img_path
+
+
+def batch_rendering(config_indices=None, workers=None, n_frames=orbit_frames):
+    """
+    Render selected configurations off-screen, without any interaction.
+
+    The configurations are independent, so they are rendered in parallel worker processes. Each worker
+    renders with its own off-screen render window, the volume is read once at import (and inherited by
+    forked workers). Existing descriptions are kept, new ones can be added to the .txt files afterwards.
+    Parallel workers share the CPU, so for comparable render timings use a single worker.
+
+    Parameters:
+    - config_indices: List of indices to render. None means render all.
+    - workers: Number of worker processes. None means one per CPU core (at most one per configuration).
+    - n_frames: Frames of the camera orbit each configuration is timed over.
+    """
+    indices = config_indices if config_indices else range(len(configurations))
+    selected = [configurations[idx] for idx in indices]
+    workers = min(workers or os.cpu_count() or 1, len(selected))
+
+    start = time.perf_counter()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            img_paths = list(executor.map(partial(render_offscreen, n_frames=n_frames, concurrent_renders=workers), selected))
+    else:
+        img_paths = [render_offscreen(config, n_frames) for config in selected]
+    for config, img_path in zip(selected, img_paths):
+        print(f"Screenshot saved for {config['name']} at {img_path}")
+    print(f"Rendered {len(selected)} configurations in {time.perf_counter() - start:.1f} s with {workers} worker(s)")
+
+
 # Generate Markdown Report
+def show_previews(config_indices=None):
+    """Show NumPy projection previews of the selected configurations along all axes in one window."""
+    import matplotlib.pyplot as plt
+
+    indices = config_indices if config_indices else range(len(configurations))
+    selected = [configurations[idx] for idx in indices]
+    preview = ProjectionPreview(volume_data, step=preview_step)
+    fig, axes = plt.subplots(len(selected), len(AXES), figsize=(3 * len(AXES), 3 * len(selected)), squeeze=False)
+    for row, config in zip(axes, selected):
+        for ax, axis in zip(row, AXES):
+            ax.imshow(preview.render(config["blending"], config["cmap"], config["opacity"], axis))
+            ax.set_title(f"{config['name']} ({config['blending']}), {axis}", fontsize=9)
+            ax.axis("off")
+    fig.tight_layout()
+    plt.show()
+
+
+def format_performance(performance):
+    """Format the render timings of a configuration as one line of markdown."""
+    return (f"first frame {performance['first_frame_ms']} ms, "
+            f"mean frame {performance['mean_frame_ms']} ms, "
+            f"p95 frame {performance['p95_frame_ms']} ms "
+            f"({performance['orbit_frames']} frame orbit at {performance['window_size'][0]}x{performance['window_size'][1]}), "
+            f"mapper: {performance.get('mapper', 'unknown')}")
+
+
 def generate_markdown():
-    """Generate a markdown file using stored screenshots, descriptions, and configurations."""
+    """Generate a markdown file using stored screenshots, descriptions, configurations, and render timings."""
     markdown_file = "volume_task2_report.md"
+    timed_configs = []
+    preview = ProjectionPreview(volume_data, step=preview_step)
     with open(markdown_file, "w") as f:
         f.write("# Volume Rendering Report\n\n")
         for config in configurations:
@@ -124,13 +233,34 @@ def generate_markdown():
             config_details = load_configuration(config_name)
             if os.path.exists(img_path):
                 f.write(f"## {config_name}\n\n")
+                performance = None
                 if config_details:
+                    config_details = dict(config_details)
+                    performance = config_details.pop("performance", None)
                     f.write("**Configuration Used:**\n")
                     f.write(f"```json\n{json.dumps(config_details, indent=4)}\n```\n\n")
                 f.write(f"![{config_name}]({img_path})\n\n")
+                preview_paths = save_previews(preview, config, output_dir)
+                f.write(f"**Projection Previews** ({', '.join(AXES)}, computed with NumPy, without shading): "
+                        + " ".join(f"![{config_name} {axis}]({path})" for axis, path in zip(AXES, preview_paths))
+                        + "\n\n")
+                if performance:
+                    f.write(f"**Render Performance**: {format_performance(performance)}\n\n")
+                    timed_configs.append((config_details, performance))
                 f.write(f"**Description**: {description}\n\n")
             else:
                 print(f"Warning: No screenshot found for {config_name}")
+
+        # Side by side comparison, to pick settings that stay interactive
+        if timed_configs:
+            f.write("## Render Performance\n\n")
+            f.write("| Configuration | Blending | Shade | First frame (ms) | Mean frame (ms) | p95 frame (ms) | Mapper |\n")
+            f.write("|---|---|---|---|---|---|---|\n")
+            for config_details, performance in timed_configs:
+                f.write(f"| {config_details['name']} | {config_details['blending']} | {config_details['shade']} | "
+                        f"{performance['first_frame_ms']} | {performance['mean_frame_ms']} | "
+                        f"{performance['p95_frame_ms']} | {performance.get('mapper', 'unknown')} |\n")
+            f.write("\n")
     print(f"Markdown report saved as {markdown_file}")
 
 
@@ -143,6 +273,29 @@ if __name__ == "__main__":
         type=int,
         help="Render specific configurations by index (1-based). If empty, renders all.",
     )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Render off-screen at a fixed camera in parallel processes, without interaction "
+             "(all configurations unless --render selects some).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes for --batch (default: number of CPU cores).",
+    )
+    parser.add_argument(
+        "--orbit-frames",
+        type=int,
+        default=orbit_frames,
+        help="Frames of the camera orbit over which --batch times each configuration.",
+    )
+    parser.add_argument(
+        "--preview",
+        action="store_true",
+        help="Show fast NumPy projection previews of the configurations (all unless --render selects some).",
+    )
     parser.add_argument(
         "--markdown",
         action="store_true",
@@ -150,8 +303,14 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
 
-    if args.render is not None:
-        indices = [(idx - 1) for idx in args.render] if args.render else None
+    indices = [(idx - 1) for idx in args.render] if args.render else None
+    if args.batch:
+        batch_rendering(config_indices=indices, workers=args.workers, n_frames=args.orbit_frames)
+        if args.markdown:
+            generate_markdown()
+    elif args.preview:
+        show_previews(config_indices=indices)
+    elif args.render is not None:
         interactive_rendering(config_indices=indices)
     elif args.markdown:
         generate_markdown()
@@ -163,5 +322,12 @@ if __name__ == "__main__":
 # python script.py --render 1 3
 # Note: During interaction, press 's' to save the screenshot before closing the window.
 #
+# Render all configurations off-screen in parallel and regenerate the markdown report, unattended:
+# python script.py --batch --markdown
+# (use --workers 1 for render timings that are comparable between configurations)
+#
+# Compare all configurations along all axes in a second, with NumPy projection previews:
+# python script.py --preview
+#
 # Generate a markdown report from existing screenshots and descriptions:
 # python script.py --markdownn
@@ -0,0 +1,102 @@
+import numpy as np
+import pyvista as pv
+
+from volume_access import open_volume
+from volume_lod import VolumeLOD
+
+pl = pv.Plotter()
+
+# The scalars are memory-mapped from a cache and the scalar range is precomputed, see volume_access.py
+volume_file = open_volume("shoulder.vti")
+volume_data = volume_file.image
+volume_data_min, volume_data_max = volume_file.scalar_range
+
+# Densities at which the 256 opacity values of the transfer function are placed (the volume mapper spreads them
+# evenly over the scalar range)
+densities = np.linspace(volume_data_min, volume_data_max, 256)
+
+# Time in ms after a slider event before the transfer function is updated, events in between are coalesced
+UPDATE_DELAY_MS = 30
+
+class VolumeCustomTF():
+    def __init__(self):
+        self.volume = None
+        self.update_timer = None  # Pending one-shot VTK timer that applies the latest slider values
+
+        self.slider_center_value = 1900
+        self.slider_spread_value = 360
+
+        self.slider_center = pl.add_slider_widget(
+            self.slider_center_callback,
+            [volume_data_min, volume_data_max],
+            value=self.slider_center_value,
+            title='Center',
+            pointa=(0.1, 0.9),
+            pointb=(0.4, 0.9),
+            interaction_event='always'
+        )
+        self.slider_spread = pl.add_slider_widget(
+            self.slider_spread_callback,
+            [1, 500],
+            value=self.slider_spread_value,
+            title='Spread',
+            pointa=(0.5, 0.9),
+            pointb=(0.8, 0.9),
+            interaction_event='always'
+        )
+        pl.iren.add_observer('TimerEvent', self.timer_callback)
+
+        self.create_volume()
+
+    # Densities around the center density are opaque, the opacity falls off like a Gaussian with standard
+    # deviation spread. density is a NumPy array of all 256 densities, so the function uses array operations
+    # Returns: array of values between 255 (opaque) and 0 (transparent)
+    def transfer_function(self, density, center, spread):
+        return 255 * np.exp(-0.5 * ((density - center) / spread) ** 2)
+
+    def opacity(self):
+        return np.clip(self.transfer_function(densities, self.slider_center_value, self.slider_spread_value), 0, 255)
+
+    def create_volume(self):
+        # The volume is uploaded once, afterwards only its opacity transfer function changes
+        self.volume = pl.add_volume(
+            volume_data,
+            opacity=self.opacity(),
+            mapper='smart',
+            shade=True)
+
+        # While the view is rotated or a slider is dragged, a downsampled copy (rate 2 per axis, sharing the
+        # transfer functions) is rendered, aiming at 15 frames per second
+        self.lod = VolumeLOD(pl, self.volume, volume_data, rate=2, desired_update_rate=15)
+        self.lod.track(self.slider_center)
+        self.lod.track(self.slider_spread)
+
+    def update_opacity(self):
+        # Overwrite the points of the existing vtkPiecewiseFunction (same positions and clipping as pyvista uses)
+        # instead of removing the actor and adding the volume again
+        opacity = np.minimum(self.opacity() / 255, 0.998)
+        points = np.column_stack((densities, opacity)).ravel()
+        self.volume.prop.GetScalarOpacity().FillFromDataPointer(len(densities), points)
+        pl.render()
+
+    def schedule_update(self):
+        if self.update_timer is None:
+            self.update_timer = pl.iren.create_timer(UPDATE_DELAY_MS, repeating=False)
+
+    def timer_callback(self, obj, event):
+        if self.update_timer is None:
+            return
+        self.update_timer = None  # One-shot timers are gone after firing, the next slider event creates a new one
+        self.update_opacity()
+
+    def slider_center_callback(self, value):
+        self.slider_center_value = value
+        self.schedule_update()
+        
+    def slider_spread_callback(self, value):
+        self.slider_spread_value = value
+        self.schedule_update()
+
+vis = VolumeCustomTF()
+
+pl.show()
\ No newline at end of file